@@ -1,13 +1,16 @@
 import logging
+import math
 import os
 import sys
+import threading
+from functools import wraps
 
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Response, g, request, jsonify, send_from_directory
 from flask_cors import CORS
 from flask_swagger_ui import get_swaggerui_blueprint
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
-from backend import data
+from backend import data, partitions, profiling, serialization, snapshot
 
 # Setup Logging
 logging.basicConfig(level=logging.INFO)
@@ -17,14 +20,46 @@ logger = logging.getLogger(__name__)
 app = Flask(__name__)
 SQLITE_URI = f"""sqlite:///{os.path.abspath(os.path.join(os.path.dirname(__file__), '..',
                                                          'data', 'db', 'flights.sqlite3'))}"""
+# Directory of flights_YYYY[_MM].sqlite3 partition files, used instead of SQLITE_URI if set
+PARTITION_DIR = os.environ.get('FLIGHTS_PARTITION_DIR')
 try:
-    data_manager = data.FlightData(SQLITE_URI)
+    if PARTITION_DIR:
+        data_manager = data.FlightData(
+            partitions=partitions.discover_partitions(PARTITION_DIR))
+    else:
+        data_manager = data.FlightData(SQLITE_URI)
     logger.info("Database connection established.")
 except Exception as e:
     logger.error("Error initializing database", exc_info=True)
     print(f"Error initializing data manager: {e}")
     data_manager = None
 
+# Pre-encoded aggregate results shared by forked server workers,
+# set by build_aggregate_snapshot (see backend/server.py)
+aggregate_snapshot = None
+
+# Time budget in seconds for the database work of each endpoint; queries still running
+# when it expires are aborted and the request fails with 504
+TIME_BUDGETS = {
+    'flight_by_id': 1.0,
+    'flights_by_date': 2.0,
+    'flight_routes': 3.0,
+    'delayed_flights': 3.0,
+    'delay_percentage': 3.0,
+    'connections': 3.0,
+}
+
+# Concurrent requests per worker process allowed on the expensive aggregate endpoints;
+# requests beyond that are shed with 503 and Retry-After
+AGGREGATE_CONCURRENCY = int(os.environ.get('FLIGHTS_AGGREGATE_CONCURRENCY', 4))
+ADMISSION_WAIT_SECONDS = 0.05
+RETRY_AFTER_SECONDS = 1
+aggregate_limiter = threading.BoundedSemaphore(AGGREGATE_CONCURRENCY)
+
+# Use orjson for responses when it is installed
+if serialization.install_json_provider(app):
+    logger.info("Using orjson for JSON responses.")
+
 # Enable CORS for all routes
 CORS(app, resources={r"/*": {"origins": "*"}})
 
@@ -41,6 +76,99 @@ swagger_ui_blueprint = get_swaggerui_blueprint(
 app.register_blueprint(swagger_ui_blueprint, url_prefix=SWAGGER_URL)
 
 
+def time_budget(name):
+    """
+    Decorator running the view under the query deadline configured in TIME_BUDGETS
+    """
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            with data.query_deadline(TIME_BUDGETS[name]):
+                return view(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def limit_concurrency(limiter):
+    """
+    Decorator admitting the view only while the limiter has a free slot, and
+    answering 503 with a Retry-After header otherwise
+    """
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if not limiter.acquire(timeout=ADMISSION_WAIT_SECONDS):
+                response = jsonify({'error': 'Server busy, please retry later'})
+                response.headers['Retry-After'] = str(RETRY_AFTER_SECONDS)
+                return response, 503
+            try:
+                return view(*args, **kwargs)
+            finally:
+                limiter.release()
+
+        return wrapper
+
+    return decorator
+
+
+@app.before_request
+def start_profiling():
+    """
+    Profiles the request if it sent 'X-Profile: 1' (when enabled) or was sampled
+    """
+    if profiling.should_profile(request.headers.get(profiling.PROFILE_HEADER)):
+        g.profile, g.profile_token = profiling.start_request()
+
+
+@app.after_request
+def finish_profiling(response):
+    """
+    Writes the .prof file of a profiled request and reports its query, materialize
+    and serialize phases in a Server-Timing header
+    """
+    profile = g.pop('profile', None)
+    if profile is not None:
+        path = profiling.stop_request(profile, g.pop('profile_token'),
+                                      request.endpoint or 'unknown')
+        response.headers['Server-Timing'] = profile.server_timing()
+        logger.info("Profiled %s: %s, %s", request.full_path, profile.server_timing(),
+                    path or "cProfile busy with another request")
+    return response
+
+
+@app.teardown_request
+def release_profiling(error):
+    """
+    Stops the profiler if the request failed before finish_profiling ran
+    """
+    profile = g.pop('profile', None)
+    if profile is not None:
+        profiling.stop_request(profile, g.pop('profile_token'), request.endpoint or 'unknown')
+
+
+@app.errorhandler(data.QueryTimeoutError)
+def handle_query_timeout(error):
+    """
+    Reports queries aborted by their time budget as 504, distinct from "no data"
+    """
+    logger.warning("Query timed out on %s: %s", request.path, error)
+    return jsonify({'error': 'Query exceeded its time budget'}), 504
+
+
+@app.errorhandler(data.PartitionQueryError)
+def handle_partition_error(error):
+    """
+    Reports a query that failed on one of the partitions as 500 instead of serving
+    results computed from the remaining partitions
+    """
+    logger.error("Partition query failed on %s: %s", request.path, error)
+    return jsonify({'error': 'Flight data is partially unavailable'}), 500
+
+
 @app.route('/static/swagger.json')
 def serve_swagger():
     """
@@ -60,28 +188,63 @@ def health_check():
     return jsonify({'status': 'ok'}), 200
 
 
+@app.route('/api/search', methods=['GET'])
+def search():
+    """
+    Handles GET requests for the '/api/search' endpoint, handles errors.
+    - Autocompletes airline names, airport names, IATA codes and cities.
+    - Tolerates typos and partial words.
+    :queryparam q: Free-text query (string, required)
+    :queryparam type: Restrict results to 'airline' or 'airport' (string, optional)
+    :queryparam limit: Maximum number of suggestions, default 10 (integer, optional)
+    :return: JSON response containing the suggestions or an error message
+    """
+    if data_manager is None:
+        return jsonify({'error': 'Database not available'}), 500
+    try:
+        query = request.args.get('q', '').strip()
+        kind = request.args.get('type')
+        limit = request.args.get('limit', default=10, type=int)
+
+        if not query:
+            return jsonify({'error': 'Parameter q is required'}), 400
+        if kind not in (None, 'airline', 'airport'):
+            return jsonify({'error': 'Invalid type. Valid types: airline, airport'}), 400
+
+        return jsonify(data_manager.search(query, max(1, min(limit, 50)), kind))
+    except Exception as error:
+        logger.error("Error searching: %s", error, exc_info=True)
+        return jsonify({'error': str(error)}), 500
+
+
 @app.route('/api/flight/<int:flight_id>', methods=['GET'])
+@time_budget('flight_by_id')
 def get_flight_by_id(flight_id):
     """
     Handles GET requests for the '/api/flight/<flight_id>' endpoint, handles errors.
     - Retrieves flight details based on the provided flight ID.
     - Returns flight details if found, otherwise an empty response.
     :param flight_id: ID of the flight to retrieve
+    :queryparam format: 'columnar' for one column header plus row arrays (string, optional)
     :return: JSON response containing flight details or an empty list
     """
     if data_manager is None:
         return jsonify({'error': 'Database not available'}), 500
     try:
-        results = data_manager.get_flight_by_id(flight_id)
-        if not results:
+        columnar = _wants_columnar()
+        results = data_manager.get_flight_by_id(flight_id, columnar=columnar)
+        if not (results[1] if columnar else results):
             return jsonify({'message': 'No flight found for the provided ID'}), 404
-        return jsonify([dict(row) for row in results])
+        return _rows_response(results)
+    except (data.QueryTimeoutError, data.PartitionQueryError):
+        raise
     except Exception as error:
         logger.error(f"error getting flight by ID: %s", error, exc_info=True)
         return jsonify({'error': str(e)}), 500
 
 
 @app.route('/api/flight/date', methods=['GET'])
+@time_budget('flights_by_date')
 def get_flights_by_date():
     """
     Handles GET requests for the '/api/flight/date' endpoint, handles errors.
@@ -90,6 +253,7 @@ def get_flights_by_date():
     :queryparam day: The day of the flight (integer, required)
     :queryparam month: The month of the flight (integer, required)
     :queryparam year: The year of the flight (integer, required)
+    :queryparam format: 'columnar' for one column header plus row arrays (string, optional)
     :return: JSON response containing a list of flights or an error message
     """
     if data_manager is None:
@@ -103,36 +267,163 @@ def get_flights_by_date():
         if not all([day, month, year]):
             return jsonify({'error': 'Missing date parameters'}), 400
 
-        results = data_manager.get_flights_by_date(day, month, year)
-        paged_results = results[offset:offset + 10]
-
-        return jsonify([dict(row) for row in paged_results])
+        results = data_manager.get_flights_by_date(day, month, year,
+                                                   columnar=_wants_columnar())
+        return _rows_response(results, offset, offset + 10)
+    except (data.QueryTimeoutError, data.PartitionQueryError):
+        raise
     except Exception as error:
         logger.error(f"error getting flights by date: %s", error, exc_info=True)
         return jsonify({'error': str(e)}), 500
 
 
 @app.route('/api/flight/routes', methods=['GET'])
+@limit_concurrency(aggregate_limiter)
+@time_budget('flight_routes')
 def get_flight_routes_with_most_frequent_destinations():
     """
     Handles GET requests for the '/api/flight/routes' endpoint, handles errors.
     - Retrieves a list of the most frequent flight routes.
     - Limits the response to 10 most frequent routes.
+    - With a bounding box, returns every route touching the viewport instead,
+      thinned to the busiest routes at low zoom levels.
+    :queryparam bbox: Viewport as min_lon,min_lat,max_lon,max_lat (string, optional)
+    :queryparam zoom: Map zoom level used with bbox, default 4 (integer, optional)
+    :queryparam format: 'columnar' for one column header plus row arrays (string, optional)
     :return: JSON response containing flight routes
     """
     if data_manager is None:
         return jsonify({'error': 'Database not available'}), 500
     try:
+        bbox = request.args.get('bbox')
+        if bbox is not None:
+            try:
+                min_lon, min_lat, max_lon, max_lat = _parse_bbox(bbox)
+            except ValueError as error:
+                return jsonify({'error': str(error)}), 400
+            zoom = request.args.get('zoom', default=4, type=int)
+            results = data_manager.get_flight_routes_in_bbox(min_lat, min_lon,
+                                                             max_lat, max_lon, zoom)
+            return _rows_response(results)
+
         offset = request.args.get('offset', default=0, type=int)
+        snapshot_response = _snapshot_response('routes', offset, offset + 10)
+        if snapshot_response is not None:
+            return snapshot_response
         results = data_manager.get_flight_routes_with_most_frequent_destinations()
-        paged_results = results[offset:offset + 10]
-        return jsonify([dict(row) for row in paged_results])
+        return _rows_response(results, offset, offset + 10)
+    except (data.QueryTimeoutError, data.PartitionQueryError):
+        raise
     except Exception as error:
         logger.error("error getting flight routes: %s", error, exc_info=True)
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/api/flights', methods=['POST'])
+def append_flights():
+    """
+    Handles POST requests for the '/api/flights' endpoint, handles errors.
+    - Inserts a batch of flights in a single transaction.
+    - Updates the running delay aggregates in the same transaction.
+    :body: JSON list of flight objects, or an object with a 'flights' list
+    :return: JSON response with the number of inserted flights or an error message;
+             409 if a given flight ID already exists
+    """
+    if data_manager is None:
+        return jsonify({'error': 'Database not available'}), 500
+    try:
+        payload = request.get_json(silent=True)
+        flights = payload.get('flights') if isinstance(payload, dict) else payload
+        if not isinstance(flights, list):
+            return jsonify({'error': 'Request body must be a JSON list of flights'}), 400
+
+        inserted = data_manager.append_flights(flights)
+        return jsonify({'inserted': inserted}), 201
+    except data.FlightConflictError as error:
+        return jsonify({'error': str(error)}), 409
+    except ValueError as error:
+        return jsonify({'error': str(error)}), 400
+    except Exception as error:
+        logger.error("Error appending flights: %s", error, exc_info=True)
+        return jsonify({'error': 'Flights could not be appended'}), 500
+
+
+@app.route('/api/airports/near', methods=['GET'])
+def get_airports_near():
+    """
+    Handles GET requests for the '/api/airports/near' endpoint, handles errors.
+    - Retrieves the airports within a radius of a point, closest first.
+    :queryparam lat: Latitude of the point (float, required)
+    :queryparam lon: Longitude of the point (float, required)
+    :queryparam radius: Search radius in kilometres, default 100 (float, optional)
+    :queryparam limit: Maximum number of airports, default 10 (integer, optional)
+    :return: JSON response containing airports or an error message
+    """
+    if data_manager is None:
+        return jsonify({'error': 'Database not available'}), 500
+    try:
+        lat = request.args.get('lat', type=float)
+        lon = request.args.get('lon', type=float)
+        radius = request.args.get('radius', default=100.0, type=float)
+        limit = request.args.get('limit', default=10, type=int)
+
+        if lat is None or lon is None:
+            return jsonify({'error': 'Parameters lat and lon are required'}), 400
+        # float() accepts 'nan' and 'inf', which no range comparison lets through
+        if not (-90 <= lat <= 90 and -180 <= lon <= 180
+                and math.isfinite(radius) and radius > 0):
+            return jsonify({'error': 'Invalid coordinates or radius'}), 400
+
+        return jsonify(data_manager.get_airports_near(lat, lon, radius, max(1, limit)))
+    except Exception as error:
+        logger.error("Error getting airports near point: %s", error, exc_info=True)
+        return jsonify({'error': 'Airports could not be retrieved'}), 500
+
+
+@app.route('/api/routes/connections', methods=['GET'])
+@limit_concurrency(aggregate_limiter)
+@time_budget('connections')
+def get_connections():
+    """
+    Handles GET requests for the '/api/routes/connections' endpoint, handles errors.
+    - Retrieves the best direct, one-stop and two-stop connections between two airports.
+    :queryparam origin: IATA code or name of the departure airport (string, required)
+    :queryparam destination: IATA code or name of the arrival airport (string, required)
+    :queryparam max_stops: Maximum number of stops, 0 to 2, default 2 (integer, optional)
+    :queryparam k: Number of connections, 1 to 20, default 5 (integer, optional)
+    :queryparam weight: 'delay' (lowest delay risk, default) or 'frequency'
+                        (most flights on the least served leg) (string, optional)
+    :return: JSON response containing connections or an error message
+    """
+    if data_manager is None:
+        return jsonify({'error': 'Database not available'}), 500
+    try:
+        origin = request.args.get('origin')
+        destination = request.args.get('destination')
+        max_stops = request.args.get('max_stops', default=2, type=int)
+        k = request.args.get('k', default=5, type=int)
+        weight = request.args.get('weight', default='delay')
+
+        if not origin or not destination:
+            return jsonify({'error': 'Parameters origin and destination are required'}), 400
+        try:
+            results = data_manager.find_connections(origin, destination, max_stops, k, weight)
+        except ValueError as error:
+            return jsonify({'error': str(error)}), 400
+
+        if not results:
+            return jsonify({'message': 'No connections found'}), 404
+        return jsonify(results)
+    except (data.QueryTimeoutError, data.PartitionQueryError):
+        raise
+    except Exception as error:
+        logger.error("Error finding connections: %s", error, exc_info=True)
+        return jsonify({'error': str(error)}), 500
+
+
 @app.route('/api/flight/delay/', methods=['GET'])
+@limit_concurrency(aggregate_limiter)
+@time_budget('delayed_flights')
 def get_delayed_flights():
     """
     Handles GET requests for the '/api/flight/delay/' endpoint, handles errors.
@@ -140,8 +431,10 @@ def get_delayed_flights():
     - If an airline is provided, returns delayed flights for that airline.
     - If an airport is provided, returns delayed flights for that airport.
     - Limits the response to 10 results.
-    :queryparam airline: Full name of the airline (string, optional)
+    :queryparam airline: Name of the airline, matched tolerantly; an ambiguous name
+                         is answered with 400 and the matching airlines (string, optional)
     :queryparam airport: IATA code of the airport (string, optional)
+    :queryparam format: 'columnar' for one column header plus row arrays (string, optional)
     :return: JSON response containing delayed flights or an error message
     """
     if data_manager is None:
@@ -154,24 +447,33 @@ def get_delayed_flights():
         if airline and airport:
             return jsonify(
                 {'error': 'Please provide either an airline or an airport, not both'}), 400
+        columnar = _wants_columnar()
+        if airline and data_manager.resolve_airline(airline) is None:
+            suggestions = data_manager.search(airline, 5, 'airline')
+            if suggestions:
+                return jsonify({'error': 'Airline name is ambiguous',
+                                'suggestions': [match['label'] for match in suggestions]}), 400
         if airline:
-            results = data_manager.get_delayed_flights_by_airline(airline)
+            results = data_manager.get_delayed_flights_by_airline(airline, columnar=columnar)
         elif airport:
-            results = data_manager.get_delayed_flights_by_airport(airport)
+            results = data_manager.get_delayed_flights_by_airport(airport, columnar=columnar)
         else:
             return jsonify({'error': 'Parameter airline or airport is required'}), 400
 
-        if not results:
+        if not (results[1] if columnar else results):
             return jsonify({'message': 'No delayed flights found'}), 404
 
-        paged_results = results[offset:offset + 10]
-        return jsonify([dict(row) for row in paged_results])
+        return _rows_response(results, offset, offset + 10)
+    except (data.QueryTimeoutError, data.PartitionQueryError):
+        raise
     except Exception as error:
         logger.error("Error getting delayed flights: %s", error, exc_info=True)
         return jsonify({'error': str(e)}), 500
 
 
 @app.route('/api/flight/delay/percentage/', methods=['GET'])
+@limit_concurrency(aggregate_limiter)
+@time_budget('delay_percentage')
 def get_delay_percentage():
     """
     Handles GET requests for the '/api/flight/delay/percentage/' endpoint, handles errors.
@@ -179,6 +481,7 @@ def get_delay_percentage():
     - Limits the response to 10 results when the category is 'airports'.
     :queryparam category: Category for delay percentage calculation (string, required)
                           Options: 'airline', 'hour', 'airports'
+    :queryparam format: 'columnar' for one column header plus row arrays (string, optional)
     :return: JSON response containing delay percentages or an error message
     """
     if data_manager is None:
@@ -193,6 +496,10 @@ def get_delay_percentage():
                     'error': f'Invalid category. '
                              f'Valid categories: {", ".join(valid_categories)}'}), 400
 
+        snapshot_response = _snapshot_response(category)
+        if snapshot_response is not None:
+            return snapshot_response
+
         if category == 'airline':
             results = data_manager.get_delay_percentage_by_airline()
         elif category == 'hour':
@@ -202,11 +509,98 @@ def get_delay_percentage():
 
         if not results:
             return jsonify({'message': 'No delay percentages found'}), 404
-        return jsonify([dict(row) for row in results])
+        return _rows_response(results)
+    except (data.QueryTimeoutError, data.PartitionQueryError):
+        raise
     except Exception as error:
         logger.error("Error getting delay percentages: %s", error, exc_info=True)
         return jsonify({'error': str(e)}), 500
 
 
+def build_aggregate_snapshot():
+    """
+    Computes the delay percentage and route results once and stores them, encoded, in a
+    read-only shared snapshot. The production server calls this in the parent process
+    before forking, so all workers serve the same pages instead of each rebuilding them.
+    """
+    global aggregate_snapshot
+    if data_manager is None:
+        return
+    try:
+        data_version = data_manager.get_data_version()
+        results = {
+            'airline': data_manager.get_delay_percentage_by_airline(),
+            'hour': data_manager.get_delay_percentage_by_hour(),
+            'airports': data_manager.get_delay_percentage_by_airports(),
+            'routes': data_manager.get_flight_routes_with_most_frequent_destinations(),
+        }
+    except data.PartitionQueryError as error:
+        logger.error("Aggregate snapshot not built, serving live results: %s", error)
+        return
+    aggregate_snapshot = snapshot.AggregateSnapshot(results, data_version)
+    logger.info("Aggregate snapshot built: %d bytes at data version %d",
+                len(aggregate_snapshot), data_version)
+
+
+def _snapshot_response(key, start=0, stop=None):
+    """
+    Serves rows of the aggregate snapshot as a JSON array response
+    :return: Response, or None if there is no snapshot, no rows for key,
+             or flights were appended since the snapshot was built
+    """
+    if aggregate_snapshot is None or key not in aggregate_snapshot or _wants_columnar():
+        return None
+    if not aggregate_snapshot.count(key):
+        return None
+    if aggregate_snapshot.data_version != data_manager.get_data_version():
+        return None
+    with profiling.phase('serialize'):
+        return Response(aggregate_snapshot.json_body(key, start, stop),
+                        mimetype='application/json')
+
+
+def _wants_columnar():
+    """
+    Checks whether the request asked for the columnar response format
+    """
+    return request.args.get('format') == 'columnar'
+
+
+def _rows_response(results, start=0, stop=None):
+    """
+    Builds the JSON response for query results, sliced like a list.
+    (column names, row tuples) results from the columnar query path are sent as they
+    are; row objects are sent as a list of JSON objects, or converted to the columnar
+    layout if the request asked for it.
+    """
+    if isinstance(results, tuple):
+        columns, rows = results
+        payload = {'columns': columns, 'rows': rows[start:stop]}
+    else:
+        with profiling.phase('materialize'):
+            if _wants_columnar():
+                payload = serialization.to_columnar(results[start:stop])
+            else:
+                payload = [dict(row) for row in results[start:stop]]
+    with profiling.phase('serialize'):
+        return jsonify(payload)
+
+
+def _parse_bbox(value):
+    """
+    Parses a 'min_lon,min_lat,max_lon,max_lat' bounding box query parameter
+    :raises ValueError: if the value is not four numbers within coordinate range
+    :return: Tuple of (min_lon, min_lat, max_lon, max_lat)
+    """
+    try:
+        min_lon, min_lat, max_lon, max_lat = (float(part) for part in value.split(','))
+    except ValueError:
+        raise ValueError('bbox must be min_lon,min_lat,max_lon,max_lat') from None
+    if not (-90 <= min_lat <= max_lat <= 90
+            and -180 <= min_lon <= 180 and -180 <= max_lon <= 180):
+        raise ValueError('bbox is out of range')
+    return min_lon, min_lat, max_lon, max_lat
+
+
 if __name__ == '__main__':
     app.run(host="0.0.0.0", port=5002, debug=True)
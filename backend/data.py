@@ -1,6 +1,66 @@
+import contextvars
+import json
 import logging
+import math
+import os
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+from functools import partial
+from operator import itemgetter
+
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.exc import IntegrityError
+
+from backend import profiling
+from backend.graph import CONNECTION_WEIGHTS, MAX_CONNECTION_STOPS, MAX_CONNECTIONS, RouteGraph
+from backend.partitions import Partition
+from backend.search import SearchIndex
+from backend.spatial import AirportGrid
+
+# Number of SQLite virtual machine instructions between two deadline checks
+PROGRESS_CHECK_INTERVAL = 1000
+
+# Absolute time.monotonic() deadline for the queries of the current request, if any
+_query_deadline = contextvars.ContextVar('query_deadline', default=None)
+
+
+class QueryTimeoutError(Exception):
+    """
+    Raised when a query is aborted because it ran past the deadline set by query_deadline
+    """
+
+
+class FlightConflictError(Exception):
+    """
+    Raised when appended flights reuse a flight ID that already exists
+    """
+
+
+class PartitionQueryError(Exception):
+    """
+    Raised when a query spread over several partitions fails on one of them, so that a
+    result missing that partition is never merged and served as complete
+    """
+
+
+@contextmanager
+def query_deadline(seconds):
+    """
+    Gives every FlightData query run inside the block, including the partition fan-out,
+    a shared time budget. Statements still running when it expires are aborted by
+    SQLite and surface as QueryTimeoutError.
+    """
+    deadline = time.monotonic() + seconds
+    current = _query_deadline.get()
+    token = _query_deadline.set(deadline if current is None else min(current, deadline))
+    try:
+        yield
+    finally:
+        _query_deadline.reset(token)
 
-from sqlalchemy import create_engine, text
 
 QUERY_FLIGHT_BY_ID = ("SELECT flights.*, "
                       "airlines.airline, "
@@ -23,7 +83,7 @@ QUERY_DELAYED_FLIGHTS_BY_AIRLINE = ("SELECT flights.*, "
                                     "flights.ID as FLIGHT_ID, "
                                     "flights.DEPARTURE_DELAY as DELAY FROM flights "
                                     "JOIN airlines ON flights.airline = airlines.id "
-                                    "WHERE airlines.AIRLINE = :airline "
+                                    "WHERE flights.AIRLINE = :airline_id "
                                     "AND flights.DEPARTURE_DELAY >= 20")
 
 QUERY_DELAYED_FLIGHTS_BY_AIRPORT = ("SELECT flights.*, "
@@ -34,60 +94,199 @@ QUERY_DELAYED_FLIGHTS_BY_AIRPORT = ("SELECT flights.*, "
                                     "WHERE flights.ORIGIN_AIRPORT = :airport "
                                     "AND flights.DEPARTURE_DELAY >= 20")
 
-QUERY_DELAY_PERCENTAGE_BY_AIRLINE = ("SELECT airlines.airline AS AIRLINE_NAME, "
-                                     "CAST(SUM(CASE WHEN flights.DEPARTURE_DELAY >= 20 THEN 1 "
-                                     "ELSE 0 END) AS FLOAT) / COUNT(*) * 100 AS DELAY_PERCENTAGE "
-                                     "FROM flights JOIN airlines ON flights.airline = airlines.id "
-                                     "GROUP BY AIRLINE_NAME "
-                                     "ORDER BY DELAY_PERCENTAGE DESC;")
-
-QUERY_DELAY_PERCENTAGE_BY_HOUR = ("SELECT CAST(SUBSTR(flights.DEPARTURE_TIME, 1, 2) AS INTEGER) "
-                                  "AS HOUR, "
-                                  "CAST(SUM(CASE WHEN flights.DEPARTURE_DELAY >= 20 THEN 1 "
-                                  "ELSE 0 END) AS FLOAT) / COUNT(*) * 100 AS DELAY_PERCENTAGE "
-                                  "FROM flights "
-                                  "GROUP BY HOUR "
-                                  "ORDER BY HOUR;")
-
-QUERY_DELAY_PERCENTAGE_BY_AIRPORTS = ("SELECT flights.ORIGIN_AIRPORT, "
-                                      "flights.DESTINATION_AIRPORT, "
-                                      "CAST(SUM(CASE WHEN flights.DEPARTURE_DELAY >= 20 "
-                                      "THEN 1 ELSE 0 END) AS FLOAT) / COUNT(*) * 100 "
-                                      "AS DELAY_PERCENTAGE "
-                                      "FROM flights "
-                                      "GROUP BY flights.ORIGIN_AIRPORT, "
-                                      "flights.DESTINATION_AIRPORT "
-                                      "ORDER BY DELAY_PERCENTAGE DESC;")
-
-QUERY_FLIGHT_ROUTES_WITH_DELAY_AND_AIRPORTS = ("WITH MostFrequentDestinations AS "
-                                               "(SELECT ORIGIN_AIRPORT, DESTINATION_AIRPORT, "
-                                               "COUNT(*) AS frequency "
-                                               "FROM flights "
-                                               "GROUP BY ORIGIN_AIRPORT, DESTINATION_AIRPORT "
-                                               "ORDER BY frequency DESC) "
-                                               "SELECT f.ORIGIN_AIRPORT, "
-                                               "f.DESTINATION_AIRPORT, "
+# The delay percentage queries return partial (FLIGHT_COUNT, DELAYED_COUNT) rows per
+# partition; FlightData merges them and derives DELAY_PERCENTAGE.
+QUERY_DELAY_COUNTS_BY_AIRLINE = ("SELECT airlines.airline AS AIRLINE_NAME, "
+                                 "SUM(counts.FLIGHT_COUNT) AS FLIGHT_COUNT, "
+                                 "SUM(counts.DELAYED_COUNT) AS DELAYED_COUNT "
+                                 "FROM airline_delay_counts AS counts "
+                                 "JOIN airlines ON counts.AIRLINE = airlines.id "
+                                 "GROUP BY AIRLINE_NAME;")
+
+QUERY_DELAY_COUNTS_BY_HOUR = ("SELECT NULLIF(HOUR, -1) AS HOUR, "
+                              "FLIGHT_COUNT, "
+                              "DELAYED_COUNT "
+                              "FROM hour_delay_counts;")
+
+QUERY_DELAY_COUNTS_BY_AIRPORTS = ("SELECT ORIGIN_AIRPORT, "
+                                  "DESTINATION_AIRPORT, "
+                                  "FLIGHT_COUNT, "
+                                  "DELAYED_COUNT "
+                                  "FROM route_delay_counts;")
+
+QUERY_FLIGHT_ROUTES_WITH_DELAY_AND_AIRPORTS = ("SELECT r.ORIGIN_AIRPORT, "
+                                               "r.DESTINATION_AIRPORT, "
                                                "o.CITY AS ORIGIN_CITY, "
                                                "d.CITY AS DESTINATION_CITY, "
                                                "o.LATITUDE AS ORIGIN_LAT, "
                                                "o.LONGITUDE AS ORIGIN_LON, "
                                                "d.LATITUDE AS DESTINATION_LAT, "
                                                "d.LONGITUDE AS DESTINATION_LON, "
-                                               "CAST(SUM(CASE WHEN f.DEPARTURE_DELAY >= 20 THEN 1 "
-                                               "ELSE 0 END) AS FLOAT) / COUNT(*) * 100 "
-                                               "AS DELAY_PERCENTAGE "
-                                               "FROM flights as f "
+                                               "r.FLIGHT_COUNT, "
+                                               "r.DELAYED_COUNT "
+                                               "FROM route_delay_counts as r "
                                                "JOIN airports as o "
-                                               "ON f.ORIGIN_AIRPORT = o.IATA_CODE "
+                                               "ON r.ORIGIN_AIRPORT = o.IATA_CODE "
                                                "JOIN airports as d "
-                                               "ON f.DESTINATION_AIRPORT = d.IATA_CODE "
-                                               "JOIN MostFrequentDestinations as mfd "
-                                               "ON f.ORIGIN_AIRPORT = mfd.ORIGIN_AIRPORT "
-                                               "AND f.DESTINATION_AIRPORT = mfd.DESTINATION_AIRPORT"
-                                               " GROUP BY f.ORIGIN_AIRPORT, f.DESTINATION_AIRPORT, "
-                                               "o.CITY, d.CITY, o.LATITUDE, o.LONGITUDE, "
-                                               "d.LATITUDE, d.LONGITUDE "
-                                               "ORDER BY delay_percentage DESC;")
+                                               "ON r.DESTINATION_AIRPORT = d.IATA_CODE;")
+
+# Running (count, delayed count) tables behind the percentage queries. They are
+# created and backfilled from the flights table once, then kept up to date by
+# FlightData.append_flights in the same transaction as the inserted flights.
+# Flights without a departure time are counted under the HOUR sentinel -1.
+# Databases that cannot get the tables (read-only files) are read through TEMP views
+# of the same name instead, which compute the counts by scanning the flights table.
+AGGREGATE_TABLES = {
+    'airline_delay_counts': {
+        'create': ("CREATE TABLE airline_delay_counts ("
+                   "AIRLINE INTEGER PRIMARY KEY, "
+                   "FLIGHT_COUNT INTEGER NOT NULL, "
+                   "DELAYED_COUNT INTEGER NOT NULL)"),
+        'update': ("INSERT INTO airline_delay_counts (AIRLINE, FLIGHT_COUNT, DELAYED_COUNT) "
+                   "SELECT AIRLINE, COUNT(*), "
+                   "SUM(CASE WHEN DEPARTURE_DELAY >= 20 THEN 1 ELSE 0 END) "
+                   "FROM {source} WHERE true "
+                   "GROUP BY AIRLINE "
+                   "ON CONFLICT (AIRLINE) DO UPDATE SET "
+                   "FLIGHT_COUNT = FLIGHT_COUNT + excluded.FLIGHT_COUNT, "
+                   "DELAYED_COUNT = DELAYED_COUNT + excluded.DELAYED_COUNT"),
+        'scan': ("SELECT AIRLINE, COUNT(*) AS FLIGHT_COUNT, "
+                 "SUM(CASE WHEN DEPARTURE_DELAY >= 20 THEN 1 ELSE 0 END) AS DELAYED_COUNT "
+                 "FROM flights GROUP BY AIRLINE"),
+    },
+    'hour_delay_counts': {
+        'create': ("CREATE TABLE hour_delay_counts ("
+                   "HOUR INTEGER PRIMARY KEY, "
+                   "FLIGHT_COUNT INTEGER NOT NULL, "
+                   "DELAYED_COUNT INTEGER NOT NULL)"),
+        'update': ("INSERT INTO hour_delay_counts (HOUR, FLIGHT_COUNT, DELAYED_COUNT) "
+                   "SELECT COALESCE(CAST(SUBSTR(DEPARTURE_TIME, 1, 2) AS INTEGER), -1) "
+                   "AS FLIGHT_HOUR, COUNT(*), "
+                   "SUM(CASE WHEN DEPARTURE_DELAY >= 20 THEN 1 ELSE 0 END) "
+                   "FROM {source} WHERE true "
+                   "GROUP BY FLIGHT_HOUR "
+                   "ON CONFLICT (HOUR) DO UPDATE SET "
+                   "FLIGHT_COUNT = FLIGHT_COUNT + excluded.FLIGHT_COUNT, "
+                   "DELAYED_COUNT = DELAYED_COUNT + excluded.DELAYED_COUNT"),
+        'scan': ("SELECT COALESCE(CAST(SUBSTR(DEPARTURE_TIME, 1, 2) AS INTEGER), -1) AS HOUR, "
+                 "COUNT(*) AS FLIGHT_COUNT, "
+                 "SUM(CASE WHEN DEPARTURE_DELAY >= 20 THEN 1 ELSE 0 END) AS DELAYED_COUNT "
+                 "FROM flights GROUP BY 1"),
+    },
+    'route_delay_counts': {
+        'create': ("CREATE TABLE route_delay_counts ("
+                   "ORIGIN_AIRPORT TEXT NOT NULL, "
+                   "DESTINATION_AIRPORT TEXT NOT NULL, "
+                   "FLIGHT_COUNT INTEGER NOT NULL, "
+                   "DELAYED_COUNT INTEGER NOT NULL, "
+                   "PRIMARY KEY (ORIGIN_AIRPORT, DESTINATION_AIRPORT))"),
+        'update': ("INSERT INTO route_delay_counts "
+                   "(ORIGIN_AIRPORT, DESTINATION_AIRPORT, FLIGHT_COUNT, DELAYED_COUNT) "
+                   "SELECT ORIGIN_AIRPORT, DESTINATION_AIRPORT, COUNT(*), "
+                   "SUM(CASE WHEN DEPARTURE_DELAY >= 20 THEN 1 ELSE 0 END) "
+                   "FROM {source} "
+                   "WHERE ORIGIN_AIRPORT IS NOT NULL AND DESTINATION_AIRPORT IS NOT NULL "
+                   "GROUP BY ORIGIN_AIRPORT, DESTINATION_AIRPORT "
+                   "ON CONFLICT (ORIGIN_AIRPORT, DESTINATION_AIRPORT) DO UPDATE SET "
+                   "FLIGHT_COUNT = FLIGHT_COUNT + excluded.FLIGHT_COUNT, "
+                   "DELAYED_COUNT = DELAYED_COUNT + excluded.DELAYED_COUNT"),
+        'scan': ("SELECT ORIGIN_AIRPORT, DESTINATION_AIRPORT, COUNT(*) AS FLIGHT_COUNT, "
+                 "SUM(CASE WHEN DEPARTURE_DELAY >= 20 THEN 1 ELSE 0 END) AS DELAYED_COUNT "
+                 "FROM flights "
+                 "WHERE ORIGIN_AIRPORT IS NOT NULL AND DESTINATION_AIRPORT IS NOT NULL "
+                 "GROUP BY ORIGIN_AIRPORT, DESTINATION_AIRPORT"),
+    },
+}
+
+QUERY_AIRLINES = "SELECT ID, AIRLINE FROM airlines"
+
+QUERY_AIRPORTS = "SELECT IATA_CODE, AIRPORT, CITY, LATITUDE, LONGITUDE FROM airports"
+
+QUERY_FLIGHT_ROUTES_FOR_AIRPORTS = ("SELECT r.ORIGIN_AIRPORT, "
+                                    "r.DESTINATION_AIRPORT, "
+                                    "o.CITY AS ORIGIN_CITY, "
+                                    "d.CITY AS DESTINATION_CITY, "
+                                    "o.LATITUDE AS ORIGIN_LAT, "
+                                    "o.LONGITUDE AS ORIGIN_LON, "
+                                    "d.LATITUDE AS DESTINATION_LAT, "
+                                    "d.LONGITUDE AS DESTINATION_LON, "
+                                    "r.FLIGHT_COUNT, "
+                                    "r.DELAYED_COUNT "
+                                    "FROM route_delay_counts as r "
+                                    "JOIN airports as o ON r.ORIGIN_AIRPORT = o.IATA_CODE "
+                                    "JOIN airports as d ON r.DESTINATION_AIRPORT = d.IATA_CODE "
+                                    "WHERE r.ORIGIN_AIRPORT IN "
+                                    "(SELECT value FROM json_each(:airports)) "
+                                    "OR r.DESTINATION_AIRPORT IN "
+                                    "(SELECT value FROM json_each(:airports))")
+
+QUERY_ROUTE_DELAY_COUNTS = ("SELECT ORIGIN_AIRPORT, DESTINATION_AIRPORT, "
+                            "FLIGHT_COUNT, DELAYED_COUNT FROM route_delay_counts")
+
+# Level of detail for viewport route queries: at zoom level z only the
+# min(MAX_ROUTES_IN_VIEW, ROUTES_PER_ZOOM_STEP * 2 ** (z - 2)) busiest routes are returned,
+# so a continent-wide view stays light and detail is paged in as the map zooms in.
+ROUTES_PER_ZOOM_STEP = 25
+MAX_ROUTES_IN_VIEW = 1000
+
+FLIGHT_INDEXES = ("CREATE INDEX IF NOT EXISTS idx_flights_airline_delay "
+                  "ON flights (AIRLINE, DEPARTURE_DELAY)",)
+
+# Single-row counter bumped by every append, so processes sharing a database can tell
+# whether results they cached are still current
+CREATE_DATA_VERSION = ("CREATE TABLE IF NOT EXISTS data_version ("
+                       "ID INTEGER PRIMARY KEY CHECK (ID = 1), "
+                       "VERSION INTEGER NOT NULL)")
+
+SEED_DATA_VERSION = "INSERT OR IGNORE INTO data_version (ID, VERSION) VALUES (1, 0)"
+
+BUMP_DATA_VERSION = "UPDATE data_version SET VERSION = VERSION + 1 WHERE ID = 1"
+
+QUERY_DATA_VERSION = "SELECT VERSION FROM data_version WHERE ID = 1"
+
+# Stand-in for the data_version table of a read-only database, which never changes
+SCAN_DATA_VERSION = "SELECT 1 AS ID, 0 AS VERSION"
+
+# Next free flight ID, kept in the first partition so that every process sharing the
+# database reserves IDs from the same counter (SQLite serializes the reservations)
+CREATE_FLIGHT_ID_SEQUENCE = ("CREATE TABLE IF NOT EXISTS flight_id_sequence ("
+                             "ID INTEGER PRIMARY KEY CHECK (ID = 1), "
+                             "NEXT_ID INTEGER NOT NULL)")
+
+SEED_FLIGHT_ID_SEQUENCE = ("INSERT INTO flight_id_sequence (ID, NEXT_ID) VALUES (1, :next_id) "
+                           "ON CONFLICT (ID) DO UPDATE "
+                           "SET NEXT_ID = max(NEXT_ID, excluded.NEXT_ID)")
+
+RESERVE_FLIGHT_IDS = ("UPDATE flight_id_sequence "
+                      "SET NEXT_ID = max(NEXT_ID, :minimum) + :count WHERE ID = 1 "
+                      "RETURNING NEXT_ID - :count AS FIRST_ID")
+
+QUERY_EXISTING_TABLES = "SELECT name FROM sqlite_master WHERE type = 'table'"
+
+QUERY_FLIGHTS_COLUMNS = "PRAGMA table_info(flights)"
+
+QUERY_FLIGHT_ID_RANGE = "SELECT MIN(ID) AS MIN_ID, MAX(ID) AS MAX_ID FROM flights"
+
+CREATE_STAGED_FLIGHTS = ("CREATE TEMP TABLE IF NOT EXISTS staged_flights AS "
+                         "SELECT * FROM flights WHERE 0")
+
+REQUIRED_FLIGHT_COLUMNS = ('YEAR', 'MONTH', 'DAY', 'AIRLINE',
+                           'ORIGIN_AIRPORT', 'DESTINATION_AIRPORT')
+
+# Appended flight columns that feed the aggregate tables or identify the flight,
+# with the type their values are converted to
+FLIGHT_COLUMN_TYPES = {
+    'ID': int,
+    'YEAR': int,
+    'MONTH': int,
+    'DAY': int,
+    'AIRLINE': int,
+    'DEPARTURE_DELAY': float,
+    'ARRIVAL_DELAY': float,
+}
+
+QUERY_EXISTING_FLIGHT_IDS = ("SELECT ID FROM flights "
+                             "WHERE ID IN (SELECT value FROM json_each(:ids))")
 
 
 class FlightData:
@@ -95,78 +294,343 @@ class FlightData:
     The FlightData class is a Data Access Layer (DAL) object that provides an
     interface to the flight data in the SQLITE database. When the object is created,
     the class forms connection to the sqlite database file, which remains active
-    until the object is destroyed
+    until the object is destroyed.
+    The data can also be split over several SQLite files partitioned by year or month
+    (see backend.partitions). Lookups then only touch the partitions that can hold the
+    answer and aggregates are computed per partition on a worker pool and merged.
     """
 
-    def __init__(self, db_uri):
+    def __init__(self, db_uri=None, partitions=None, max_workers=None):
+        """
+        Initialize a new engine using the given database URI, or one engine per partition,
+        and make sure the running aggregate tables exist
+        :param db_uri: URI of a single, unpartitioned database
+        :param partitions: List of Partition objects, used instead of db_uri
+        :param max_workers: Size of the worker pool for partition fan-out,
+                            defaults to the number of CPUs
+        """
+        if (db_uri is None) == (partitions is None):
+            raise ValueError("Provide either db_uri or partitions")
+        self._partitions = [Partition(db_uri)] if partitions is None else list(partitions)
+        if not self._partitions:
+            raise ValueError("No partitions provided")
+        self._max_workers = max_workers or os.cpu_count()
+        self._executor = ThreadPoolExecutor(max_workers=self._max_workers,
+                                            thread_name_prefix="flight-data")
+        self._flight_columns = None
+        self._route_graph = None
+        self._route_graph_lock = threading.Lock()
+
+        for partition in self._partitions:
+            partition.engine = create_engine(partition.db_uri)
+            if partition.engine.dialect.name == 'sqlite':
+                _configure_sqlite_engine(partition.engine)
+        list(self._executor.map(self._prepare_partition, self._partitions))
+        self._seed_flight_ids()
+        self._search_index, self._airport_grid = self._build_indexes()
+
+        os.register_at_fork(after_in_child=partial(_reset_in_child, weakref.ref(self)))
+
+    def reset_after_fork(self):
+        """
+        Makes the object safe to use in a forked child process. Pooled connections
+        inherited from the parent are dropped without closing them (the parent still
+        owns them) so the child opens its own, and the worker pool and route graph lock,
+        whose threads and state do not survive a fork, are replaced.
+        """
+        for partition in self._partitions:
+            partition.engine.dispose(close=False)
+        self._executor = ThreadPoolExecutor(max_workers=self._max_workers,
+                                            thread_name_prefix="flight-data")
+        self._route_graph_lock = threading.Lock()
+
+    def _prepare_partition(self, partition):
+        """
+        Creates the aggregate tables and indexes of a partition and reads its ID range
+        """
+        self._ensure_aggregates(partition)
+        self._ensure_indexes(partition)
+        self._add_scan_views(partition)
+        for row in self._execute_query(QUERY_FLIGHT_ID_RANGE, partition=partition):
+            if row['MIN_ID'] is not None:
+                partition.track_id(row['MIN_ID'])
+                partition.track_id(row['MAX_ID'])
+
+    def _seed_flight_ids(self):
+        """
+        Creates the flight ID sequence, or moves it past the highest ID in any partition
+        if flights were added without it
+        """
+        next_id = max((partition.max_id for partition in self._partitions
+                       if partition.max_id is not None), default=0) + 1
+        try:
+            with _write_transaction(self._partitions[0].engine) as connection:
+                connection.execute(text(CREATE_FLIGHT_ID_SEQUENCE))
+                connection.execute(text(SEED_FLIGHT_ID_SEQUENCE), {'next_id': next_id})
+        except Exception as error:
+            logging.error("Error creating the flight ID sequence: %s", error)
+
+    def _reserve_flight_ids(self, count, minimum):
+        """
+        Reserves a block of consecutive flight IDs, unique across partitions and processes
+        :param count: Number of IDs to reserve
+        :param minimum: Lowest acceptable ID, one above any ID given explicitly in the batch
+        :return: First reserved ID
+        """
+        with _write_transaction(self._partitions[0].engine) as connection:
+            return connection.execute(text(RESERVE_FLIGHT_IDS),
+                                      {'count': count, 'minimum': minimum}).scalar_one()
+
+    def _ensure_aggregates(self, partition):
+        """
+        Creates any missing aggregate table and backfills it from the flights table,
+        all in one transaction. Databases that already carry the tables are left as they are.
+        """
+        try:
+            with _write_transaction(partition.engine) as connection:
+                existing = set(connection.execute(text(QUERY_EXISTING_TABLES)).scalars())
+                if 'flights' not in existing:
+                    logging.warning("No flights table found in partition %s, "
+                                    "skipping aggregate tables", partition.name)
+                    return
+                connection.execute(text(CREATE_DATA_VERSION))
+                connection.execute(text(SEED_DATA_VERSION))
+                for name, statements in AGGREGATE_TABLES.items():
+                    if name in existing:
+                        continue
+                    logging.info("Backfilling aggregate table %s in partition %s",
+                                 name, partition.name)
+                    connection.execute(text(statements['create']))
+                    connection.execute(text(statements['update'].format(source='flights')))
+        except Exception as error:
+            logging.error("Error preparing aggregate tables: %s", error)
+
+    def _add_scan_views(self, partition):
+        """
+        Falls back to scanning the flights table for the aggregate tables (and the data
+        version) a partition could not get, typically because the database is read-only:
+        every connection of the partition gets TEMP views of the same names
+        """
+        existing = {row['name'] for row in
+                    self._execute_query(QUERY_EXISTING_TABLES, partition=partition)}
+        if 'flights' not in existing:
+            return
+        views = {name: statements['scan'] for name, statements in AGGREGATE_TABLES.items()
+                 if name not in existing}
+        if 'data_version' not in existing:
+            views['data_version'] = SCAN_DATA_VERSION
+        if not views:
+            return
+        logging.warning("Partition %s lacks %s, computing them from the flights table",
+                        partition.name, ", ".join(views))
+        event.listen(partition.engine, "connect", partial(_create_scan_views, views))
+        # Pooled connections were opened without the views
+        partition.engine.dispose()
+
+    def _ensure_indexes(self, partition):
+        """
+        Creates the flights table indexes the lookups rely on, if they are missing
+        """
+        try:
+            with _write_transaction(partition.engine) as connection:
+                for statement in FLIGHT_INDEXES:
+                    connection.execute(text(statement))
+        except Exception as error:
+            logging.error("Error creating flight indexes: %s", error)
+
+    def _build_indexes(self):
+        """
+        Builds the in-memory search index over airline names and airports and the
+        spatial grid over airport coordinates
+        :return: Tuple of (SearchIndex, AirportGrid), empty if the tables could not be read
+        """
+        index = SearchIndex()
+        grid = AirportGrid()
+        for row in self._execute_query(QUERY_AIRLINES):
+            index.add('airline', row['ID'], row['AIRLINE'])
+        for row in self._execute_query(QUERY_AIRPORTS):
+            index.add('airport', row['IATA_CODE'], row['AIRPORT'],
+                      row['IATA_CODE'], row['CITY'], city=row['CITY'])
+            grid.add(row['IATA_CODE'], row['LATITUDE'], row['LONGITUDE'],
+                     AIRPORT=row['AIRPORT'], CITY=row['CITY'])
+        logging.info("Search index built with %d entries, airport grid with %d airports",
+                     len(index), len(grid))
+        return index, grid
+
+    def _get_flight_columns(self):
         """
-        Initialize a new engine using the given database URI
+        Returns the column names of the flights table, read once from the database
         """
-        self._engine = create_engine(db_uri)
+        if self._flight_columns is None:
+            rows = self._execute_query(QUERY_FLIGHTS_COLUMNS)
+            self._flight_columns = [row['name'] for row in rows]
+        return self._flight_columns
 
-    def _execute_query(self, query, params={}):
+    def _execute_query(self, query, params={}, partition=None, columnar=False, strict=False):
         """
         Execute an SQL query with the params provided in a dictionary, handles errors
         and returns a list of records (dictionary-like objects).
-        :return: list of row objects if successful, else an empty list
+        :param partition: Partition to run the query on, defaults to the first one
+                          (every partition carries the airlines and airports tables)
+        :param columnar: Return the column names and the plain row tuples of the
+                         DBAPI cursor instead, skipping the per-row mapping objects
+        :param strict: Raise PartitionQueryError instead of returning an empty result
+        :raises QueryTimeoutError: if the query runs past the current query_deadline
+        :raises PartitionQueryError: if strict and the query fails
+        :return: list of row objects if successful, else an empty list;
+                 with columnar, a tuple of (column names, list of row tuples)
         """
+        partition = partition or self._partitions[0]
+        deadline = _query_deadline.get()
         try:
-            with self._engine.connect() as connection:
-                results = connection.execute(text(query), params)
-                return results.mappings().all()
+            with partition.engine.connect() as connection:
+                started = time.perf_counter()
+                with _enforce_deadline(connection, deadline):
+                    # pysqlite only steps to the first row in execute(); the rest of
+                    # the scan runs while fetching, so the fetch belongs to 'query'
+                    with profiling.phase('query'):
+                        results = connection.execute(text(query), params)
+                        columns = list(results.keys())
+                        fetched = results.cursor.fetchall() if columnar else results.fetchall()
+                    with profiling.phase('materialize'):
+                        if columnar:
+                            rows = _columnar_rows(columns, fetched)
+                        else:
+                            rows = [row._mapping for row in fetched]
+                elapsed = time.perf_counter() - started
+                if elapsed >= profiling.SLOW_QUERY_SECONDS:
+                    profiling.log_slow_query(query, params, elapsed,
+                                             _explain_query(connection, query, params),
+                                             f"partition {partition.name}")
+                return rows
+        except QueryTimeoutError:
+            raise
         except Exception as error:
-            logging.error("Error executing query: %s", error)
-            return []
+            if deadline is not None and time.monotonic() >= deadline:
+                raise QueryTimeoutError("Query exceeded its time budget") from error
+            logging.error("Error executing query on partition %s: %s", partition.name, error)
+            if strict:
+                raise PartitionQueryError(
+                    f"Query failed on partition {partition.name}") from error
+            return ([], []) if columnar else []
 
-    def get_flight_by_id(self, flight_id):
+    def _fan_out(self, query, params={}, partitions=None, columnar=False):
+        """
+        Runs a query on several partitions in parallel on the worker pool.
+        SQLite releases the GIL while it steps through a statement, so the partitions
+        are scanned on separate cores. The workers run in a copy of the caller's
+        context, so they share its query deadline.
+        :param partitions: Partitions to query, defaults to all of them
+        :param columnar: Return (column names, row tuples), see _execute_query
+        :raises PartitionQueryError: if the query fails on any of several partitions
+        :return: Concatenated list of row objects, in partition order
+        """
+        partitions = self._partitions if partitions is None else partitions
+        if not partitions:
+            return ([], []) if columnar else []
+        if len(partitions) == 1:
+            results = [self._execute_query(query, params, partitions[0], columnar)]
+        else:
+            futures = [self._executor.submit(contextvars.copy_context().run,
+                                             self._execute_query, query, params,
+                                             partition, columnar, True)
+                       for partition in partitions]
+            results = [future.result() for future in futures]
+        if columnar:
+            columns = next((columns for columns, _ in results if columns), [])
+            return columns, [row for _, rows in results for row in rows]
+        return [row for rows in results for row in rows]
+
+    def get_flight_by_id(self, flight_id, columnar=False):
         """
         Searches for flight details using flight ID.
+        :param columnar: Return (column names, row tuples) instead
         :return: List of tuples containing flight details
         """
         params = {'id': flight_id}
-        return self._execute_query(QUERY_FLIGHT_BY_ID, params)
+        partitions = [partition for partition in self._partitions
+                      if partition.may_contain_id(flight_id)]
+        results = self._fan_out(QUERY_FLIGHT_BY_ID, params, partitions, columnar)
+        if (results[1] if columnar else results) or len(partitions) == len(self._partitions):
+            return results
+        # Flights appended by other processes are outside the ID ranges known here
+        others = [partition for partition in self._partitions if partition not in partitions]
+        return self._fan_out(QUERY_FLIGHT_BY_ID, params, others, columnar)
 
-    def get_flights_by_date(self, day, month, year):
+    def get_flights_by_date(self, day, month, year, columnar=False):
         """
         Searches for flight details using the date with day/month/year, handles errors
 
+        :param columnar: Return (column names, row tuples) instead
         :return: List of tuples containing flight details
         """
         if not (1 <= day <= 31 and 1 <= month <= 12 and year > 1900):
             logging.warning("Invalid date parameters")
-            return []
+            return ([], []) if columnar else []
         params = {'day': day, 'month': month, 'year': year}
-        return self._execute_query(QUERY_FLIGHTS_BY_DATE, params)
+        partitions = [partition for partition in self._partitions
+                      if partition.covers(year, month)]
+        return self._fan_out(QUERY_FLIGHTS_BY_DATE, params, partitions, columnar)
+
+    def search(self, query, limit=10, kind=None):
+        """
+        Autocompletes free text against airline names, airport names, IATA codes and
+        cities, tolerating typos
+        :param kind: 'airline' or 'airport' to restrict the results
+        :return: List of dictionaries with type, id, label and score
+        """
+        return self._search_index.search(query, limit, kind)
+
+    def resolve_airline(self, airline):
+        """
+        Resolves a free-text airline name to its airline ID using the search index
+        :return: Airline ID, or None if no airline matches
+        """
+        return self._search_index.resolve('airline', airline)
 
-    def get_delayed_flights_by_airline(self, airline):
+    def get_delayed_flights_by_airline(self, airline, columnar=False):
         """
-        Searches for delayed flights details using airline name, handles errors
+        Searches for delayed flights details using airline name, handles errors.
+        The name is resolved to an airline ID first, so near misses and typos in any
+        word of the name still find the airline (an ambiguous name finds nothing) and
+        the flights lookup runs on the integer airline index.
+        :param columnar: Return (column names, row tuples) instead
         :return: List of tuples containing flight details
         """
-        params = {'airline': airline}
-        return self._execute_query(QUERY_DELAYED_FLIGHTS_BY_AIRLINE, params)
+        airline_id = self.resolve_airline(airline)
+        if airline_id is None:
+            logging.warning("No airline matches %r", airline)
+            return ([], []) if columnar else []
+        params = {'airline_id': airline_id}
+        return self._fan_out(QUERY_DELAYED_FLIGHTS_BY_AIRLINE, params, columnar=columnar)
 
-    def get_delayed_flights_by_airport(self, airport):
+    def get_delayed_flights_by_airport(self, airport, columnar=False):
         """
         Searches for delayed flights details using airport IATA codes, handles errors
+        :param columnar: Return (column names, row tuples) instead
         :return: List of tuples containing flight details
         """
         params = {'airport': airport}
-        return self._execute_query(QUERY_DELAYED_FLIGHTS_BY_AIRPORT, params)
+        return self._fan_out(QUERY_DELAYED_FLIGHTS_BY_AIRPORT, params, columnar=columnar)
 
     def get_delay_percentage_by_airline(self):
         """
         Fetches the percentage of delayed flights for each airline, handles errors
         :return: List of tuples containing flight route information
         """
-        return self._execute_query(QUERY_DELAY_PERCENTAGE_BY_AIRLINE)
+        results = _merge_delay_counts(self._fan_out(QUERY_DELAY_COUNTS_BY_AIRLINE),
+                                      ('AIRLINE_NAME',))
+        results.sort(key=lambda row: row['DELAY_PERCENTAGE'], reverse=True)
+        return results
 
     def get_delay_percentage_by_hour(self):
         """
         Fetches the percentage of delayed flights for each hour, handles errors
         :return: List of tuples containing (hour, delay_percentage)
         """
-        return self._execute_query(QUERY_DELAY_PERCENTAGE_BY_HOUR)
+        results = _merge_delay_counts(self._fan_out(QUERY_DELAY_COUNTS_BY_HOUR), ('HOUR',))
+        results.sort(key=lambda row: (row['HOUR'] is not None, row['HOUR']))
+        return results
 
     def get_delay_percentage_by_airports(self):
         """
@@ -174,7 +638,10 @@ class FlightData:
         destination airports, handles errors
         :return: List of tuples containing (origin_airport, destination_airport, delay_percentage)
         """
-        return self._execute_query(QUERY_DELAY_PERCENTAGE_BY_AIRPORTS)
+        results = _merge_delay_counts(self._fan_out(QUERY_DELAY_COUNTS_BY_AIRPORTS),
+                                      ('ORIGIN_AIRPORT', 'DESTINATION_AIRPORT'))
+        results.sort(key=lambda row: row['DELAY_PERCENTAGE'], reverse=True)
+        return results
 
     def get_flight_routes_with_most_frequent_destinations(self):
         """
@@ -182,10 +649,370 @@ class FlightData:
         and airport information (latitude, longitude), handles errors
         :return: List of tuples containing flight route information
         """
-        return self._execute_query(QUERY_FLIGHT_ROUTES_WITH_DELAY_AND_AIRPORTS)
+        results = _merge_delay_counts(
+            self._fan_out(QUERY_FLIGHT_ROUTES_WITH_DELAY_AND_AIRPORTS),
+            ('ORIGIN_AIRPORT', 'DESTINATION_AIRPORT'))
+        results.sort(key=lambda row: row['DELAY_PERCENTAGE'], reverse=True)
+        return results
+
+    def get_airports_near(self, lat, lon, radius_km=100, limit=10):
+        """
+        Fetches the airports within radius_km of a point from the spatial grid
+        :return: List of dictionaries with airport details and DISTANCE_KM, closest first
+        """
+        return self._airport_grid.nearest(lat, lon, radius_km, limit)
+
+    def get_flight_routes_in_bbox(self, min_lat, min_lon, max_lat, max_lon, zoom):
+        """
+        Fetches the routes with at least one airport inside the bounding box, thinned
+        to the busiest routes for low zoom levels, handles errors
+        :param zoom: Map zoom level (0 = whole world), controls how many routes are kept
+        :return: List of tuples containing flight route information and FLIGHT_COUNT
+        """
+        airports = self._airport_grid.within(min_lat, min_lon, max_lat, max_lon)
+        if not airports:
+            return []
+        params = {'airports': json.dumps([airport['IATA_CODE'] for airport in airports])}
+        results = _merge_delay_counts(self._fan_out(QUERY_FLIGHT_ROUTES_FOR_AIRPORTS, params),
+                                      ('ORIGIN_AIRPORT', 'DESTINATION_AIRPORT'),
+                                      keep_flight_count=True)
+        results.sort(key=lambda row: row['FLIGHT_COUNT'], reverse=True)
+        limit = min(MAX_ROUTES_IN_VIEW, int(ROUTES_PER_ZOOM_STEP * 2 ** (zoom - 2)))
+        return results[:max(1, limit)]
+
+    def find_connections(self, origin, destination, max_stops=2, k=5, weight='delay'):
+        """
+        Finds the best direct, one-stop and two-stop connections between two airports
+        on the in-memory route graph. Airports are given by IATA code or free text.
+        :param max_stops: Maximum number of intermediate airports (0 to 2)
+        :param k: Number of connections to return (1 to 20)
+        :param weight: 'delay' for the lowest risk of a delayed leg,
+                       'frequency' for the most flights on the least served leg
+        :raises ValueError: if max_stops, k or weight is out of range
+        :return: List of dictionaries with AIRPORTS, STOPS, DELAY_RISK, MIN_FLIGHT_COUNT
+                 and LEGS, best first
+        """
+        if weight not in CONNECTION_WEIGHTS:
+            raise ValueError(f"weight must be one of {', '.join(CONNECTION_WEIGHTS)}")
+        if not 0 <= max_stops <= MAX_CONNECTION_STOPS:
+            raise ValueError(f"max_stops must be between 0 and {MAX_CONNECTION_STOPS}")
+        if not 1 <= k <= MAX_CONNECTIONS:
+            raise ValueError(f"k must be between 1 and {MAX_CONNECTIONS}")
+
+        graph = self._get_route_graph()
+        codes = []
+        for airport in (origin, destination):
+            code = str(airport).strip().upper()
+            if code not in graph:
+                code = self._search_index.resolve('airport', airport)
+            if code is None:
+                logging.warning("No airport matches %r", airport)
+                return []
+            codes.append(code)
+        return graph.find_connections(codes[0], codes[1], max_stops, k, weight)
+
+    def _get_route_graph(self):
+        """
+        Returns the route graph, rebuilding it from the route aggregates of all partitions
+        when the data version changed since it was built (also by other processes)
+        :return: RouteGraph
+        """
+        data_version = self.get_data_version()
+        graph = self._route_graph
+        if graph is not None and graph.data_version == data_version:
+            return graph
+        with self._route_graph_lock:
+            graph = self._route_graph
+            if graph is None or graph.data_version != data_version:
+                routes = _merge_delay_counts(self._fan_out(QUERY_ROUTE_DELAY_COUNTS),
+                                             ('ORIGIN_AIRPORT', 'DESTINATION_AIRPORT'),
+                                             keep_flight_count=True)
+                graph = RouteGraph(routes, data_version)
+                if routes:
+                    # An empty graph may come from a failed read, so it is not kept
+                    self._route_graph = graph
+                logging.info("Route graph built with %d airports and %d routes "
+                             "at data version %d", len(graph.airports), len(graph),
+                             data_version)
+        return graph
+
+    def append_flights(self, flights):
+        """
+        Inserts a batch of flights and updates the airline, hour and route aggregate
+        tables in a single transaction, so readers never see one without the other.
+        Each flight is a dictionary keyed by flights table column names (case-insensitive);
+        missing columns are stored as NULL. With several partitions, every flight goes to
+        the partition of its YEAR/MONTH, and flights without an ID get one that is unique
+        across partitions and server processes. The write transactions of all partitions
+        stay open until every partition has been written, so a failed write commits no
+        flights (SQLite cannot commit several files atomically, only a failure of the
+        commits themselves could still leave a partial batch).
+        :raises ValueError: if the batch is empty, a flight is missing a required column,
+                            uses a column the flights table does not have, has a value
+                            of the wrong type or falls outside every partition
+        :raises FlightConflictError: if a flight ID is given twice or already exists
+        :return: Number of inserted flights
+        """
+        if not flights:
+            raise ValueError("No flights provided")
+        known_columns = {column.upper(): column for column in self._get_flight_columns()}
+        batches = {}
+        for flight in flights:
+            if not isinstance(flight, dict):
+                raise ValueError("Each flight must be an object of column values")
+            row = {}
+            for key, value in flight.items():
+                column = known_columns.get(str(key).upper())
+                if column is None:
+                    raise ValueError(f"Unknown flight column: {key}")
+                row[column] = _convert_flight_value(column.upper(), value)
+            missing = [column for column in REQUIRED_FLIGHT_COLUMNS
+                       if row.get(known_columns.get(column, column)) is None]
+            if missing:
+                raise ValueError(f"Missing flight columns: {', '.join(missing)}")
+
+            year, month = row[known_columns['YEAR']], row[known_columns['MONTH']]
+            if not (1 <= month <= 12 and 1 <= row[known_columns['DAY']] <= 31):
+                raise ValueError("MONTH or DAY is out of range")
+            partition = next((partition for partition in self._partitions
+                              if partition.covers(year, month)), None)
+            if partition is None:
+                raise ValueError(f"No partition holds flights of {year}-{month:02d}")
+            batches.setdefault(id(partition), (partition, []))[1].append(row)
+
+        if 'ID' in known_columns:
+            id_column = known_columns['ID']
+            rows = [row for _, partition_rows in batches.values() for row in partition_rows]
+            given = [row[id_column] for row in rows if row.get(id_column) is not None]
+            if len(set(given)) != len(given):
+                raise FlightConflictError("The batch contains the same flight ID twice")
+            if given and self._fan_out(QUERY_EXISTING_FLIGHT_IDS, {'ids': json.dumps(given)}):
+                raise FlightConflictError("A flight with the given ID already exists")
+            next_id = self._reserve_flight_ids(len(rows) - len(given),
+                                               max(given, default=0) + 1)
+            for row in rows:
+                if row.get(id_column) is None:
+                    row[id_column] = next_id
+                    next_id += 1
+
+        # Partitions are locked in a fixed order, so concurrent batches cannot each hold
+        # the lock the other one waits for
+        ordered = sorted(batches.values(),
+                         key=lambda batch: self._partitions.index(batch[0]))
+        try:
+            with ExitStack() as transactions:
+                connections = [transactions.enter_context(_write_transaction(partition.engine))
+                               for partition, _ in ordered]
+                for connection, (_, rows) in zip(connections, ordered):
+                    self._write_flights(connection, rows, list(known_columns.values()))
+        except IntegrityError as error:
+            # Another request inserted one of the given IDs after the check above
+            raise FlightConflictError("A flight with the given ID already exists") from error
+        for partition, rows in ordered:
+            if 'ID' in known_columns:
+                for row in rows:
+                    partition.track_id(int(row[known_columns['ID']]))
+        return sum(len(rows) for _, rows in batches.values())
+
+    def _write_flights(self, connection, rows, known_columns):
+        """
+        Stages validated flights in a temporary table, folds them into the aggregate
+        tables and copies them into the flights table of a partition, within the write
+        transaction open on connection
+        """
+        columns = [column for column in known_columns if any(column in row for row in rows)]
+        params = [{column: row.get(column) for column in columns} for row in rows]
+        column_list = ", ".join(columns)
+        placeholders = ", ".join(f":{column}" for column in columns)
+
+        connection.execute(text(CREATE_STAGED_FLIGHTS))
+        connection.execute(text("DELETE FROM staged_flights"))
+        connection.execute(text(f"INSERT INTO staged_flights ({column_list}) "
+                                f"VALUES ({placeholders})"), params)
+        for statements in AGGREGATE_TABLES.values():
+            connection.execute(text(statements['update'].format(source='staged_flights')))
+        connection.execute(text(f"INSERT INTO flights ({column_list}) "
+                                f"SELECT {column_list} FROM staged_flights"))
+        connection.execute(text("DELETE FROM staged_flights"))
+        connection.execute(text(BUMP_DATA_VERSION))
+
+    def get_data_version(self):
+        """
+        Fetches the data version, which grows with every appended batch in any
+        partition and in any process, handles errors
+        :return: Integer data version
+        """
+        return sum(row['VERSION'] for row in self._fan_out(QUERY_DATA_VERSION))
 
     def __del__(self):
         """
-        Closes the connection to the database when the object is about to be destroyed
+        Closes the connections to the database when the object is about to be destroyed
         """
-        self._engine.dispose()
+        for partition in getattr(self, '_partitions', ()):
+            if partition.engine is not None:
+                partition.engine.dispose()
+        if hasattr(self, '_executor'):
+            self._executor.shutdown(wait=False)
+
+
+def _convert_flight_value(column, value):
+    """
+    Converts an appended flight value to the type of its column (see FLIGHT_COLUMN_TYPES),
+    so that a bad value is rejected before it reaches the aggregate tables
+    :param column: Upper-case column name
+    :raises ValueError: if the value does not have the column's type
+    :return: The converted value; None and values of other columns are returned as they are
+    """
+    expected = FLIGHT_COLUMN_TYPES.get(column)
+    if expected is None or value is None:
+        return value
+    try:
+        if isinstance(value, bool):
+            raise ValueError
+        converted = expected(value)
+        if expected is int and isinstance(value, float) and converted != value:
+            raise ValueError
+        if expected is float and not math.isfinite(converted):
+            raise ValueError
+    except (TypeError, ValueError):
+        kind = "an integer" if expected is int else "a number"
+        raise ValueError(f"{column} must be {kind}") from None
+    return converted
+
+
+def _merge_delay_counts(rows, key_columns, keep_flight_count=False):
+    """
+    Merges partial (FLIGHT_COUNT, DELAYED_COUNT) rows from one or more partitions by
+    their key columns and derives DELAY_PERCENTAGE from the totals
+    :param keep_flight_count: Keep FLIGHT_COUNT in the merged rows
+    :return: List of dictionaries with the non-count columns and DELAY_PERCENTAGE
+    """
+    merged = {}
+    for row in rows:
+        key = tuple(row[column] for column in key_columns)
+        entry = merged.get(key)
+        if entry is None:
+            entry = merged[key] = [dict(row), 0, 0]
+        entry[1] += row['FLIGHT_COUNT'] or 0
+        entry[2] += row['DELAYED_COUNT'] or 0
+
+    results = []
+    for values, flight_count, delayed_count in merged.values():
+        del values['FLIGHT_COUNT'], values['DELAYED_COUNT']
+        if not flight_count:
+            continue
+        values['DELAY_PERCENTAGE'] = delayed_count / flight_count * 100
+        if keep_flight_count:
+            values['FLIGHT_COUNT'] = flight_count
+        results.append(values)
+    return results
+
+
+def _explain_query(connection, query, params):
+    """
+    Fetches the EXPLAIN QUERY PLAN of a query with its bound parameters
+    :return: List of plan lines, empty if the plan could not be read
+    """
+    try:
+        plan = connection.execute(text(f"EXPLAIN QUERY PLAN {query}"), params).all()
+        return [row[-1] for row in plan]
+    except Exception as error:
+        logging.warning("Could not explain slow query: %s", error)
+        return []
+
+
+@contextmanager
+def _enforce_deadline(connection, deadline):
+    """
+    Installs a SQLite progress handler on the connection that aborts the running
+    statement once the deadline has passed, and removes it afterwards
+    """
+    driver_connection = connection.connection.driver_connection
+    if deadline is None or not hasattr(driver_connection, 'set_progress_handler'):
+        yield
+        return
+    if time.monotonic() >= deadline:
+        raise QueryTimeoutError("Query exceeded its time budget")
+    driver_connection.set_progress_handler(lambda: time.monotonic() >= deadline,
+                                           PROGRESS_CHECK_INTERVAL)
+    try:
+        yield
+    finally:
+        driver_connection.set_progress_handler(None, 0)
+
+
+def _reset_in_child(reference):
+    """
+    Fork hook: resets the FlightData object behind the weak reference, if it still exists
+    """
+    flight_data = reference()
+    if flight_data is not None:
+        flight_data.reset_after_fork()
+
+
+@contextmanager
+def _write_transaction(engine):
+    """
+    Opens a transaction that takes the SQLite write lock when it begins (BEGIN IMMEDIATE).
+    A deferred transaction that reads before it writes cannot wait for the lock: if another
+    process commits in between, SQLite fails it with "database is locked" right away.
+    """
+    with engine.connect() as connection:
+        connection.execution_options(begin_immediate=True)
+        with connection.begin():
+            yield connection
+
+
+def _columnar_rows(columns, rows):
+    """
+    Drops repeated column names from a columnar result the way the row mappings
+    resolve them (flights.* and airlines.airline both yield AIRLINE): each name keeps
+    its first position and the value of its last occurrence.
+    :return: Tuple of (column names, list of row tuples)
+    """
+    positions = {}
+    for position, column in enumerate(columns):
+        positions[column] = position
+    if len(positions) == len(columns):
+        return columns, rows
+    if len(positions) == 1:
+        return list(positions), [row[-1:] for row in rows]
+    project = itemgetter(*positions.values())
+    return list(positions), [project(row) for row in rows]
+
+
+def _create_scan_views(views, dbapi_connection, connection_record):
+    """
+    Connect hook creating the TEMP views set up by FlightData._add_scan_views
+    """
+    cursor = dbapi_connection.cursor()
+    for name, query in views.items():
+        cursor.execute(f"CREATE TEMP VIEW IF NOT EXISTS {name} AS {query}")
+    cursor.close()
+
+
+def _configure_sqlite_engine(engine):
+    """
+    Switches SQLite connections to WAL journaling so readers keep reading while a batch
+    is appended, and lets SQLAlchemy emit BEGIN itself so every statement inside
+    a transaction, including DDL, belongs to it
+    """
+
+    @event.listens_for(engine, "connect")
+    def _on_connect(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        try:
+            cursor.execute("PRAGMA journal_mode=WAL")
+        except Exception as error:
+            # Read-only databases keep their journal mode
+            logging.info("Could not switch to WAL journaling: %s", error)
+        cursor.execute("PRAGMA busy_timeout=5000")
+        cursor.close()
+
+    @event.listens_for(engine, "begin")
+    def _on_begin(connection):
+        if connection.get_execution_options().get('begin_immediate'):
+            connection.exec_driver_sql("BEGIN IMMEDIATE")
+        else:
+            connection.exec_driver_sql("BEGIN")
@@ -0,0 +1,165 @@
+import math
+import threading
+from array import array
+from bisect import insort
+from collections import OrderedDict
+
+CONNECTION_WEIGHTS = ('delay', 'frequency')
+MAX_CONNECTION_STOPS = 2
+MAX_CONNECTIONS = 20
+CONNECTION_CACHE_SIZE = 1024
+
+
+class RouteGraph:
+    """
+    The RouteGraph class is a compact adjacency graph of airports and the routes between
+    them, held in flat arrays (compressed sparse rows): the routes leaving airport i are
+    entries offsets[i] to offsets[i + 1] of the edge arrays, and a second set of arrays
+    lists the routes arriving at each airport. Every route carries its flight count and
+    delay probability. Connection searches are cached for the lifetime of the graph,
+    which is rebuilt rather than updated when the flight data changes.
+    """
+
+    def __init__(self, routes, data_version=None):
+        """
+        Build the graph from merged route rows
+        :param routes: Dictionaries with ORIGIN_AIRPORT, DESTINATION_AIRPORT,
+                       FLIGHT_COUNT and DELAY_PERCENTAGE
+        :param data_version: Data version the routes were read at
+        """
+        self.data_version = data_version
+        self.airports = sorted({row['ORIGIN_AIRPORT'] for row in routes}
+                               | {row['DESTINATION_AIRPORT'] for row in routes}, key=str)
+        self._index = {code: position for position, code in enumerate(self.airports)}
+        edges = sorted((self._index[row['ORIGIN_AIRPORT']],
+                        self._index[row['DESTINATION_AIRPORT']],
+                        row['FLIGHT_COUNT'], row['DELAY_PERCENTAGE'] / 100)
+                       for row in routes if row['ORIGIN_AIRPORT'] != row['DESTINATION_AIRPORT'])
+
+        self._offsets = array('l', [0] * (len(self.airports) + 1))
+        self._targets = array('l', (edge[1] for edge in edges))
+        self._flights = array('l', (edge[2] for edge in edges))
+        self._delay = array('d', (edge[3] for edge in edges))
+        # -log(1 - p) adds up along a path to -log(P(no leg is delayed))
+        self._delay_cost = array('d', (-math.log1p(-p) if p < 1 else math.inf
+                                       for p in self._delay))
+        for origin, *_ in edges:
+            self._offsets[origin + 1] += 1
+
+        incoming = sorted(range(len(edges)), key=lambda edge: edges[edge][1])
+        self._in_offsets = array('l', [0] * (len(self.airports) + 1))
+        self._in_sources = array('l', (edges[edge][0] for edge in incoming))
+        self._in_edges = array('l', incoming)
+        for edge in incoming:
+            self._in_offsets[edges[edge][1] + 1] += 1
+
+        for position in range(len(self.airports)):
+            self._offsets[position + 1] += self._offsets[position]
+            self._in_offsets[position + 1] += self._in_offsets[position]
+
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._targets)
+
+    def __contains__(self, code):
+        return code in self._index
+
+    def find_connections(self, origin, destination, max_stops=2, k=5, weight='delay'):
+        """
+        Finds the k best connections from origin to destination with at most max_stops
+        intermediate airports, never visiting an airport twice. Results are cached.
+        :param weight: 'delay' ranks by the risk that at least one leg is delayed,
+                       'frequency' by the flight count of the least served leg
+        :return: List of connection dictionaries, best first
+        """
+        key = (origin, destination, max_stops, k, weight)
+        with self._cache_lock:
+            connections = self._cache.get(key)
+            if connections is not None:
+                self._cache.move_to_end(key)
+                return connections
+
+        connections = self._search(origin, destination, max_stops, k, weight)
+        with self._cache_lock:
+            self._cache[key] = connections
+            if len(self._cache) > CONNECTION_CACHE_SIZE:
+                self._cache.popitem(last=False)
+        return connections
+
+    def _search(self, origin, destination, max_stops, k, weight):
+        """
+        Depth-first branch and bound over paths of at most max_stops + 1 legs. Both
+        rankings only get worse as a path grows (the delay cost adds up, the least
+        served leg can only shrink), so partial paths already ranked below the k-th
+        best connection are cut, and so are stops from which the destination cannot
+        be reached with the legs left (found by walking the arriving routes backwards).
+        """
+        source, target = self._index.get(origin), self._index.get(destination)
+        if source is None or target is None or source == target:
+            return []
+
+        arriving = {self._in_sources[position]: self._in_edges[position]
+                    for position in range(self._in_offsets[target],
+                                          self._in_offsets[target + 1])}
+        # finishes[n]: airports with a path of at most n legs to the destination
+        finishes = [set(), set(arriving)]
+        for _ in range(max_stops - 1):
+            finishes.append(finishes[-1] | {self._in_sources[position]
+                                             for node in finishes[-1]
+                                             for position in range(self._in_offsets[node],
+                                                                   self._in_offsets[node + 1])})
+        by_delay = weight == 'delay'
+        best = []  # sorted (score, legs, edges), at most k entries
+
+        def score(cost, bottleneck):
+            return cost if by_delay else -bottleneck
+
+        def visit(node, airports, edges, cost, bottleneck, legs_left):
+            last_leg = arriving.get(node)
+            if last_leg is not None:
+                path_edges = edges + [last_leg]
+                entry = (score(cost + self._delay_cost[last_leg],
+                               min(bottleneck, self._flights[last_leg])),
+                         len(path_edges), tuple(path_edges))
+                if len(best) < k or entry < best[-1]:
+                    insort(best, entry)
+                    del best[k:]
+            if legs_left == 1:
+                return
+            reachable = finishes[legs_left - 1]
+            for edge in range(self._offsets[node], self._offsets[node + 1]):
+                stop = self._targets[edge]
+                if stop not in reachable or stop in airports:
+                    continue
+                next_cost = cost + self._delay_cost[edge]
+                next_bottleneck = min(bottleneck, self._flights[edge])
+                if len(best) == k and score(next_cost, next_bottleneck) > best[-1][0]:
+                    continue
+                visit(stop, airports | {stop}, edges + [edge], next_cost, next_bottleneck,
+                      legs_left - 1)
+
+        visit(source, {source, target}, [], 0.0, math.inf, max_stops + 1)
+        return [self._connection(edges, source) for _, _, edges in best]
+
+    def _connection(self, edges, source):
+        """
+        Describes a path given by its edge positions
+        """
+        legs, node, cost, bottleneck = [], source, 0.0, math.inf
+        for edge in edges:
+            stop = self._targets[edge]
+            legs.append({'ORIGIN_AIRPORT': self.airports[node],
+                         'DESTINATION_AIRPORT': self.airports[stop],
+                         'FLIGHT_COUNT': self._flights[edge],
+                         'DELAY_PERCENTAGE': self._delay[edge] * 100})
+            cost += self._delay_cost[edge]
+            bottleneck = min(bottleneck, self._flights[edge])
+            node = stop
+        return {'AIRPORTS': [legs[0]['ORIGIN_AIRPORT']]
+                            + [leg['DESTINATION_AIRPORT'] for leg in legs],
+                'STOPS': len(legs) - 1,
+                'DELAY_RISK': -math.expm1(-cost) * 100,
+                'MIN_FLIGHT_COUNT': bottleneck,
+                'LEGS': legs}
@@ -0,0 +1,78 @@
+import os
+import re
+
+PARTITION_FILE_PATTERN = re.compile(r"^flights_(\d{4})(?:_(\d{2}))?\.sqlite3$")
+
+
+class Partition:
+    """
+    The Partition class describes one SQLite file of a partitioned flights database.
+    Every file holds the flights of one year (flights_2015.sqlite3) or one month
+    (flights_2015_01.sqlite3) together with its own copy of the airlines and airports
+    tables, so each file can answer queries on its own. A partition without a year
+    holds all flights, which is how a single unpartitioned database is represented.
+    """
+
+    def __init__(self, db_uri, year=None, month=None):
+        """
+        Initialize a partition for the given database URI and period
+        """
+        self.db_uri = db_uri
+        self.year = year
+        self.month = month
+        self.engine = None
+        self.min_id = None
+        self.max_id = None
+
+    @property
+    def name(self):
+        if self.year is None:
+            return "all"
+        if self.month is None:
+            return f"{self.year}"
+        return f"{self.year}-{self.month:02d}"
+
+    def __repr__(self):
+        return f"Partition({self.name!r}, {self.db_uri!r})"
+
+    def covers(self, year, month=None):
+        """
+        Checks whether flights of the given year (and month, if given) belong in
+        this partition
+        """
+        if self.year is None:
+            return True
+        if year != self.year:
+            return False
+        return self.month is None or month is None or month == self.month
+
+    def may_contain_id(self, flight_id):
+        """
+        Checks whether a flight ID falls inside the ID range stored in this partition
+        """
+        return self.min_id is not None and self.min_id <= flight_id <= self.max_id
+
+    def track_id(self, flight_id):
+        """
+        Widens the known ID range of this partition to include flight_id
+        """
+        self.min_id = flight_id if self.min_id is None else min(self.min_id, flight_id)
+        self.max_id = flight_id if self.max_id is None else max(self.max_id, flight_id)
+
+
+def discover_partitions(directory):
+    """
+    Finds the partition files in a directory, named flights_YYYY.sqlite3 or
+    flights_YYYY_MM.sqlite3
+    :return: List of Partition objects ordered by period
+    """
+    partitions = []
+    for file_name in sorted(os.listdir(directory)):
+        match = PARTITION_FILE_PATTERN.match(file_name)
+        if not match:
+            continue
+        year, month = match.groups()
+        path = os.path.abspath(os.path.join(directory, file_name))
+        partitions.append(Partition(f"sqlite:///{path}", int(year),
+                                    int(month) if month else None))
+    return partitions
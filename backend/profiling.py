@@ -0,0 +1,172 @@
+import contextvars
+import cProfile
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from logging.handlers import RotatingFileHandler
+
+# Directory for .prof files and the slow query log
+PROFILE_DIR = os.environ.get(
+    'FLIGHTS_PROFILE_DIR',
+    os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'data', 'output', 'profiles')))
+# Share of requests profiled without being asked to (0.0 - 1.0)
+PROFILE_SAMPLE_RATE = float(os.environ.get('FLIGHTS_PROFILE_SAMPLE_RATE', 0))
+# Requests sending this header with value 1 are profiled, if FLIGHTS_PROFILE_HEADER_ENABLED=1
+PROFILE_HEADER = 'X-Profile'
+PROFILE_HEADER_ENABLED = os.environ.get('FLIGHTS_PROFILE_HEADER_ENABLED') == '1'
+# Queries running at least this long get their EXPLAIN QUERY PLAN logged
+SLOW_QUERY_SECONDS = float(os.environ.get('FLIGHTS_SLOW_QUERY_MS', 500)) / 1000
+SLOW_LOG_MAX_BYTES = 5 * 1024 * 1024
+SLOW_LOG_BACKUPS = 5
+
+PHASES = ('query', 'materialize', 'serialize')
+
+_current_profile = contextvars.ContextVar('current_profile', default=None)
+# cProfile can only be active once per process on newer Pythons, so requests take turns
+_profiler_lock = threading.Lock()
+_slow_query_logger = None
+_slow_query_logger_lock = threading.Lock()
+
+
+class RequestProfile:
+    """
+    The RequestProfile class collects the time one request spends in each phase
+    (query, materialize, serialize) and, if the profiler was free, a cProfile of
+    the request thread. Phase times from partition worker threads add up, so with
+    fan-out they can exceed the wall time of the request.
+    """
+
+    def __init__(self):
+        """
+        Initialize the profile and start the profiler if no other request holds it
+        """
+        self.started = time.perf_counter()
+        self.total = 0.0
+        self.phases = dict.fromkeys(PHASES, 0.0)
+        self._lock = threading.Lock()
+        self._profiler = None
+        if _profiler_lock.acquire(blocking=False):
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+
+    def add(self, phase, seconds):
+        """
+        Adds time spent in a phase, safe to call from several threads
+        """
+        with self._lock:
+            self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+    def finish(self, name):
+        """
+        Stops the profiler and writes its stats to PROFILE_DIR
+        :param name: Request name used in the .prof file name
+        :return: Path of the written .prof file, or None if the profiler was busy
+        """
+        self.total = time.perf_counter() - self.started
+        if self._profiler is None:
+            return None
+        try:
+            self._profiler.disable()
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            safe_name = "".join(char if char.isalnum() else "_" for char in name)
+            path = os.path.join(PROFILE_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-"
+                                             f"{safe_name}-{os.getpid()}-"
+                                             f"{threading.get_ident()}.prof")
+            self._profiler.dump_stats(path)
+            return path
+        finally:
+            self._profiler = None
+            _profiler_lock.release()
+
+    def server_timing(self):
+        """
+        Formats the phase times as a Server-Timing header value (milliseconds)
+        """
+        entries = [f"{phase};dur={seconds * 1000:.1f}" for phase, seconds in self.phases.items()]
+        entries.append(f"total;dur={self.total * 1000:.1f}")
+        return ", ".join(entries)
+
+
+def should_profile(header_value):
+    """
+    Decides whether to profile a request, from its X-Profile header and the sampling rate
+    """
+    if PROFILE_HEADER_ENABLED and header_value == '1':
+        return True
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+
+def start_request():
+    """
+    Starts profiling the current request
+    :return: Tuple of (RequestProfile, token to pass to stop_request)
+    """
+    profile = RequestProfile()
+    return profile, _current_profile.set(profile)
+
+
+def stop_request(profile, token, name):
+    """
+    Stops profiling the current request and writes the .prof file
+    :return: Path of the .prof file, or None
+    """
+    _current_profile.reset(token)
+    return profile.finish(name)
+
+
+@contextmanager
+def phase(name):
+    """
+    Times the block as the named phase of the request being profiled;
+    does nothing when the request is not profiled
+    """
+    profile = _current_profile.get()
+    if profile is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.add(name, time.perf_counter() - started)
+
+
+def _get_slow_query_logger():
+    """
+    Returns the slow query logger, attaching the rotating log file on first use.
+    Slow queries only reach the application log if the file cannot be opened.
+    """
+    global _slow_query_logger
+    with _slow_query_logger_lock:
+        if _slow_query_logger is None:
+            slow_logger = logging.getLogger('backend.slow_queries')
+            try:
+                os.makedirs(PROFILE_DIR, exist_ok=True)
+                handler = RotatingFileHandler(os.path.join(PROFILE_DIR, 'slow_queries.log'),
+                                              maxBytes=SLOW_LOG_MAX_BYTES,
+                                              backupCount=SLOW_LOG_BACKUPS)
+                handler.setFormatter(logging.Formatter("%(asctime)s %(process)d %(message)s"))
+                slow_logger.addHandler(handler)
+                slow_logger.propagate = False
+            except OSError as error:
+                logging.warning("Slow query log file unavailable: %s", error)
+            _slow_query_logger = slow_logger
+        return _slow_query_logger
+
+
+def log_slow_query(query, params, seconds, plan, source):
+    """
+    Writes a slow query with its bound parameters and query plan to the rotating
+    slow query log
+    :param plan: Lines of EXPLAIN QUERY PLAN output
+    :param source: Where the query ran, e.g. the partition name
+    """
+    parameters = {key: (value if len(repr(value)) <= 200 else f"{repr(value)[:200]}...")
+                  for key, value in (params or {}).items()}
+    _get_slow_query_logger().warning(
+        "slow query (%.1f ms, %s)\n  SQL: %s\n  params: %r\n  plan:\n%s",
+        seconds * 1000, source, query, parameters,
+        "\n".join(f"    {line}" for line in plan) or "    (unavailable)")
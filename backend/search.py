@@ -0,0 +1,167 @@
+import re
+from bisect import bisect_left
+from collections import defaultdict
+from difflib import SequenceMatcher
+
+MIN_FUZZY_SCORE = 0.45
+# Similarity a misspelled query needs to a single word of an entry, e.g. "dleta" (Delta)
+MIN_WORD_SCORE = 0.75
+# How far the best match must score above the runner-up for resolve to pick it
+RESOLVE_MARGIN = 0.15
+
+_NON_ALPHANUMERIC = re.compile(r"[^0-9a-z]+")
+
+
+def normalize(value):
+    """
+    Lowercases the value and collapses everything that is not a letter or digit into
+    single spaces, so "Delta Air Lines Inc." and "delta air-lines inc" compare equal
+    """
+    return _NON_ALPHANUMERIC.sub(" ", str(value).lower()).strip()
+
+
+def trigrams(value):
+    """
+    Returns the set of character trigrams of a normalized value, padded so that
+    short strings and word starts still produce trigrams
+    """
+    padded = f"  {value} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class SearchIndex:
+    """
+    The SearchIndex class is an in-memory autocomplete index over airline names and
+    airports. Every entry is reachable through a sorted term list (prefix lookups by
+    bisection) and a trigram posting list (typo-tolerant lookups), so a search only
+    touches the handful of entries that share a prefix or trigrams with the query.
+    """
+
+    def __init__(self):
+        """
+        Initialize an empty index
+        """
+        self._entries = []
+        self._labels = {}
+        self._terms = []
+        self._terms_sorted = True
+        self._trigrams = defaultdict(set)
+        self._entry_trigrams = []
+        self._entry_words = []
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add(self, kind, key, label, *extra_terms, **details):
+        """
+        Adds an entry to the index.
+        :param kind: Entry type, e.g. 'airline' or 'airport'
+        :param key: Identifier returned for the entry (airline ID, airport IATA code)
+        :param label: Display name, indexed as a whole and word by word
+        :param extra_terms: Further searchable strings (IATA code, city)
+        :param details: Extra fields returned with the entry
+        """
+        position = len(self._entries)
+        self._entries.append({'type': kind, 'id': key, 'label': label, **details})
+        self._labels.setdefault((kind, normalize(label)), key)
+        self._entry_trigrams.append([])
+        self._entry_words.append(set())
+
+        for value in (label, *extra_terms):
+            if value is None:
+                continue
+            normalized = normalize(value)
+            if not normalized:
+                continue
+            words = normalized.split(" ")
+            for term in {normalized, *words}:
+                self._terms.append((term, position))
+            self._entry_words[position].update(words)
+            value_trigrams = trigrams(normalized)
+            self._entry_trigrams[position].append(value_trigrams)
+            for trigram in value_trigrams:
+                self._trigrams[trigram].add(position)
+        self._terms_sorted = False
+
+    def search(self, query, limit=10, kind=None):
+        """
+        Finds the entries best matching a free-text query. Exact term matches rank
+        first, then prefix matches, then fuzzy matches: trigram similarity to a whole
+        value above MIN_FUZZY_SCORE, or similarity to one of its words above
+        MIN_WORD_SCORE, so a typo in one word of a long name is still found.
+        :param kind: Only return entries of this type if given
+        :return: List of entry dictionaries with an added 'score' between 0 and 3
+        """
+        normalized = normalize(query)
+        if not normalized:
+            return []
+
+        if not self._terms_sorted:
+            self._terms = sorted(self._terms)
+            self._terms_sorted = True
+
+        scores = {}
+        start = bisect_left(self._terms, (normalized,))
+        for term, position in self._terms[start:]:
+            if not term.startswith(normalized):
+                break
+            score = 3.0 if term == normalized else 2.0
+            scores[position] = max(scores.get(position, 0.0), score)
+
+        query_trigrams = trigrams(normalized)
+        candidates = set()
+        for trigram in query_trigrams:
+            candidates.update(self._trigrams.get(trigram, ()))
+        matcher = SequenceMatcher(b=normalized, autojunk=False)
+        word_scores = {}  # words such as "airport" are shared by many entries
+        for position in candidates - scores.keys():
+            overlaps = [(len(query_trigrams & value_trigrams), len(value_trigrams))
+                        for value_trigrams in self._entry_trigrams[position]]
+            score = max(2.0 * shared / (len(query_trigrams) + size)
+                        for shared, size in overlaps)
+            if score < MIN_FUZZY_SCORE:
+                score = 0.0
+            # Entries sharing a single trigram ("  a") are not worth comparing word by word
+            words = self._entry_words[position] if max(overlaps)[0] > 1 else ()
+            for word in words:
+                word_score = word_scores.get(word)
+                if word_score is None:
+                    matcher.set_seq1(word)
+                    # The cheap upper bounds skip most words before the full comparison
+                    word_score = word_scores[word] = (
+                        matcher.ratio() if matcher.real_quick_ratio() >= MIN_WORD_SCORE
+                        and matcher.quick_ratio() >= MIN_WORD_SCORE else 0.0)
+                if word_score >= MIN_WORD_SCORE:
+                    score = max(score, word_score)
+            if score:
+                scores[position] = score
+
+        ranked = sorted(scores.items(),
+                        key=lambda item: (-item[1], self._entries[item[0]]['label']))
+        results = []
+        for position, score in ranked:
+            entry = self._entries[position]
+            if kind is not None and entry['type'] != kind:
+                continue
+            results.append({**entry, 'score': round(score, 3)})
+            if len(results) >= limit:
+                break
+        return results
+
+    def resolve(self, kind, query):
+        """
+        Resolves free text to the identifier of a single entry: an exact (normalized)
+        label match if there is one, otherwise the best search match if it scores
+        clearly above the next one. Ambiguous text such as "american" (American
+        Airlines, American Eagle) resolves to nothing rather than to either.
+        :return: The entry identifier, or None if nothing or several entries match
+        """
+        key = self._labels.get((kind, normalize(query)))
+        if key is not None:
+            return key
+        matches = self.search(query, limit=2, kind=kind)
+        if not matches:
+            return None
+        if len(matches) > 1 and matches[0]['score'] - matches[1]['score'] < RESOLVE_MARGIN:
+            return None
+        return matches[0]['id']
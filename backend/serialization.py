@@ -0,0 +1,51 @@
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def to_columnar(rows):
+    """
+    Converts a list of dictionary-like rows into the columnar response layout
+    :return: Dictionary with one 'columns' header and 'rows' as value lists
+    """
+    if not rows:
+        return {'columns': [], 'rows': []}
+    columns = list(rows[0].keys())
+    return {'columns': columns, 'rows': [[row[column] for column in columns] for row in rows]}
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """
+    Flask JSON provider encoding with orjson, which is several times faster than the
+    standard library encoder on large row lists. Output keeps the default provider's
+    conventions (sorted keys, compact separators, trailing newline on responses).
+    Only usable when the optional orjson package is installed.
+    """
+
+    options = (orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS) if orjson else 0
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default, option=self.options).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        body = orjson.dumps(obj, default=self.default,
+                            option=self.options | orjson.OPT_APPEND_NEWLINE)
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+
+def install_json_provider(app):
+    """
+    Switches the app to the orjson provider if orjson is installed
+    :return: True if the faster provider is in use
+    """
+    if orjson is None:
+        return False
+    app.json = OrjsonProvider(app)
+    return True
@@ -0,0 +1,92 @@
+import argparse
+import logging
+import os
+import sys
+
+from gunicorn.app.base import BaseApplication
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from backend import backend_api
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BIND = "0.0.0.0:5002"
+
+
+class FlightDataServer(BaseApplication):
+    """
+    Pre-forking gunicorn server for the Flight Data API. The app, its database engines
+    and the aggregate snapshot are created once in the parent process; the forked workers
+    share the snapshot pages and open their own database connections
+    (FlightData resets its engines in every forked child).
+    """
+
+    def __init__(self, options):
+        """
+        Initialize the server with gunicorn settings (bind, workers, threads, ...)
+        """
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        """
+        Copies the options into gunicorn's configuration
+        """
+        for key, value in self.options.items():
+            if key in self.cfg.settings and value is not None:
+                self.cfg.set(key, value)
+
+    def load(self):
+        """
+        Returns the WSGI app, already imported in the parent process
+        """
+        return backend_api.app
+
+
+def post_fork(server, worker):
+    """
+    Gunicorn hook, runs in every worker right after it is forked
+    """
+    logger.info("Worker %s started", worker.pid)
+
+
+def main():
+    """
+    Parses the server options (command line, falling back to FLIGHTS_BIND,
+    FLIGHTS_WORKERS and FLIGHTS_THREADS), builds the shared aggregate snapshot
+    and starts the pre-forking server
+    """
+    parser = argparse.ArgumentParser(description="Run the Flight Data API in production mode")
+    parser.add_argument("--bind", default=os.environ.get("FLIGHTS_BIND", DEFAULT_BIND),
+                        help=f"Address to listen on (default {DEFAULT_BIND})")
+    parser.add_argument("--workers", type=int,
+                        default=int(os.environ.get("FLIGHTS_WORKERS", os.cpu_count() or 1)),
+                        help="Number of worker processes (default: number of CPUs)")
+    parser.add_argument("--threads", type=int,
+                        default=int(os.environ.get("FLIGHTS_THREADS", 4)),
+                        help="Number of threads per worker (default 4)")
+    parser.add_argument("--timeout", type=int, default=60,
+                        help="Seconds before a silent worker is restarted (default 60)")
+    parser.add_argument("--no-snapshot", action="store_true",
+                        help="Skip the shared aggregate snapshot and always query live")
+    args = parser.parse_args()
+
+    if backend_api.data_manager is None:
+        logger.error("Database unavailable, not starting the server")
+        sys.exit(1)
+    if not args.no_snapshot:
+        backend_api.build_aggregate_snapshot()
+
+    FlightDataServer({
+        'bind': args.bind,
+        'workers': args.workers,
+        'threads': args.threads,
+        'worker_class': 'gthread' if args.threads > 1 else 'sync',
+        'timeout': args.timeout,
+        'preload_app': True,
+        'post_fork': post_fork,
+    }).run()
+
+
+if __name__ == '__main__':
+    main()
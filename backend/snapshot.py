@@ -0,0 +1,84 @@
+import json
+import mmap
+import tempfile
+
+
+def encode_row(row):
+    """
+    Encodes a row the way Flask's jsonify does (sorted keys, compact separators),
+    so snapshot responses are byte-for-byte identical to live ones
+    """
+    return json.dumps(dict(row), sort_keys=True, separators=(',', ':')).encode('utf-8')
+
+
+class AggregateSnapshot:
+    """
+    The AggregateSnapshot class holds pre-encoded JSON rows of the heavy aggregate
+    results in a read-only memory map. It is built once in the server's parent process
+    before the workers are forked; every worker then serves the same physical pages
+    straight from the map, without re-running the queries or copying the data.
+    """
+
+    def __init__(self, results, data_version):
+        """
+        Encodes the results and writes them to an unlinked temporary file that is
+        mapped read-only. Every key is stored as one contiguous JSON array, so any
+        slice of its rows is a single span of the map.
+        :param results: Dictionary of key -> list of rows (dictionary-like objects)
+        :param data_version: Data version the results were computed at
+        """
+        self.data_version = data_version
+        self._spans = {}
+        position = 0
+        with tempfile.TemporaryFile(prefix="flight-snapshot-") as snapshot_file:
+            for key, rows in results.items():
+                spans = []
+                snapshot_file.write(b"[")
+                position += 1
+                for index, row in enumerate(rows):
+                    if index:
+                        snapshot_file.write(b",")
+                        position += 1
+                    encoded = encode_row(row)
+                    snapshot_file.write(encoded)
+                    spans.append((position, position + len(encoded)))
+                    position += len(encoded)
+                snapshot_file.write(b"]")
+                position += 1
+                self._spans[key] = spans
+            snapshot_file.flush()
+            self._size = position
+            # mmap cannot map an empty file
+            self._map = mmap.mmap(snapshot_file.fileno(), position,
+                                  access=mmap.ACCESS_READ) if position else None
+
+    def __contains__(self, key):
+        return key in self._spans
+
+    def __len__(self):
+        return self._size
+
+    def count(self, key):
+        """
+        Returns the number of rows stored under key
+        """
+        return len(self._spans[key])
+
+    def json_body(self, key, start=0, stop=None):
+        """
+        Returns the rows stored under key, sliced like a list, as a JSON array.
+        The rows are read straight from the shared map; WSGI needs bytes, so the
+        requested span is copied once into the response body.
+        :return: JSON encoded bytes, newline-terminated like jsonify output
+        """
+        spans = self._spans[key][start:stop]
+        if not spans:
+            return b"[]\n"
+        return b"".join((b"[", self._map[spans[0][0]:spans[-1][1]], b"]\n"))
+
+    def close(self):
+        """
+        Releases the memory map
+        """
+        if self._map is not None:
+            self._map.close()
@@ -0,0 +1,104 @@
+import math
+from collections import defaultdict
+
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE_LAT = math.pi * EARTH_RADIUS_KM / 180.0
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """
+    Returns the great-circle distance between two points in kilometres
+    """
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = (math.sin((lat2 - lat1) / 2) ** 2
+         + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+class AirportGrid:
+    """
+    The AirportGrid class is an in-memory spatial index that buckets airports into
+    fixed-size latitude/longitude cells. Bounding box and radius queries only visit
+    the cells overlapping the requested area instead of every airport.
+    """
+
+    def __init__(self, cell_size=1.0):
+        """
+        Initialize an empty grid
+        :param cell_size: Cell edge length in degrees
+        """
+        self._cell_size = cell_size
+        self._cells = defaultdict(list)
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def _cell(self, lat, lon):
+        return math.floor(lat / self._cell_size), math.floor(lon / self._cell_size)
+
+    def add(self, code, lat, lon, **details):
+        """
+        Adds an airport to the grid. Airports without coordinates are ignored.
+        :param details: Extra fields returned with the airport
+        """
+        if lat is None or lon is None:
+            return
+        lat, lon = float(lat), float(lon)
+        self._cells[self._cell(lat, lon)].append(
+            {'IATA_CODE': code, 'LATITUDE': lat, 'LONGITUDE': lon, **details})
+        self._count += 1
+
+    def _within_lon_range(self, min_lat, min_lon, max_lat, max_lon):
+        min_row, min_col = self._cell(min_lat, min_lon)
+        max_row, max_col = self._cell(max_lat, max_lon)
+        if (max_row - min_row + 1) * (max_col - min_col + 1) > len(self._cells):
+            cells = (airports for (row, col), airports in self._cells.items()
+                     if min_row <= row <= max_row and min_col <= col <= max_col)
+        else:
+            cells = (self._cells.get((row, col), ())
+                     for row in range(min_row, max_row + 1)
+                     for col in range(min_col, max_col + 1))
+        for airports in cells:
+            for airport in airports:
+                if (min_lat <= airport['LATITUDE'] <= max_lat
+                        and min_lon <= airport['LONGITUDE'] <= max_lon):
+                    yield airport
+
+    def within(self, min_lat, min_lon, max_lat, max_lon):
+        """
+        Finds the airports inside a bounding box. A box with min_lon greater than
+        max_lon is taken to cross the antimeridian.
+        :return: List of airport dictionaries
+        """
+        if min_lon > max_lon:
+            return (list(self._within_lon_range(min_lat, min_lon, max_lat, 180.0))
+                    + list(self._within_lon_range(min_lat, -180.0, max_lat, max_lon)))
+        return list(self._within_lon_range(min_lat, min_lon, max_lat, max_lon))
+
+    def nearest(self, lat, lon, radius_km, limit=10):
+        """
+        Finds the airports within radius_km of a point, closest first
+        :return: List of airport dictionaries with an added DISTANCE_KM
+        """
+        lat_span = radius_km / KM_PER_DEGREE_LAT
+        if lat + lat_span >= 90.0 or lat - lat_span <= -90.0:
+            # The circle contains a pole, so it covers every longitude
+            min_lon, max_lon = -180.0, 180.0
+        else:
+            # Widest longitude offset of the circle, reached north of its centre
+            # (south in the southern hemisphere) where the meridians converge
+            lon_span = math.degrees(math.asin(math.sin(radius_km / EARTH_RADIUS_KM)
+                                              / math.cos(math.radians(lat))))
+            min_lon = (lon - lon_span + 180.0) % 360.0 - 180.0
+            max_lon = (lon + lon_span + 180.0) % 360.0 - 180.0
+        candidates = self.within(max(-90.0, lat - lat_span), min_lon,
+                                 min(90.0, lat + lat_span), max_lon)
+
+        results = []
+        for airport in candidates:
+            distance = haversine_km(lat, lon, airport['LATITUDE'], airport['LONGITUDE'])
+            if distance <= radius_km:
+                results.append({**airport, 'DISTANCE_KM': round(distance, 1)})
+        results.sort(key=lambda airport: airport['DISTANCE_KM'])
+        return results[:limit]
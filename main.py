@@ -72,11 +72,20 @@ def visualize_delay_by_hour(data_manager):
 
 def delayed_flights_by_airline(data_manager):
     """
-    Asks the user for a textual airline name (any string will work here).
+    Asks the user for a textual airline name (partial names and typos are resolved
+    to the closest airline).
     Then runs the query using the data object method "get_delayed_flights_by_airline".
     When results are back, calls "print_results" to show them to on the screen.
     """
     airline_input = input("Enter airline name: ")
+    if data_manager.resolve_airline(airline_input) is None:
+        suggestions = data_manager.search(airline_input, 5, 'airline')
+        if suggestions:
+            print(f"'{airline_input}' matches several airlines: "
+                  + ", ".join(match['label'] for match in suggestions))
+        else:
+            print(f"No airline matches '{airline_input}'.")
+        return
     results = data_manager.get_delayed_flights_by_airline(airline_input)
     print_results(results)
 
@@ -0,0 +1,110 @@
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from backend import data
+from backend.serialization import orjson
+from scripts.generate_db import generate_database
+
+BENCHMARK_DAY, BENCHMARK_MONTH, BENCHMARK_YEAR = 1, 1, 2015
+
+
+def stdlib_dumps(obj):
+    """
+    Encodes like Flask's default JSON provider (sorted keys, compact separators)
+    """
+    return json.dumps(obj, sort_keys=True, separators=(',', ':')).encode('utf-8')
+
+
+def orjson_dumps(obj):
+    """
+    Encodes like backend.serialization.OrjsonProvider
+    """
+    return orjson.dumps(obj, option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS)
+
+
+def rows_payload(flight_data):
+    """
+    Current response path: row mappings, converted to dictionaries
+    """
+    results = flight_data.get_flights_by_date(BENCHMARK_DAY, BENCHMARK_MONTH, BENCHMARK_YEAR)
+    return [dict(row) for row in results]
+
+
+def columnar_payload(flight_data):
+    """
+    Columnar response path: one column header and the cursor's row tuples
+    """
+    columns, rows = flight_data.get_flights_by_date(BENCHMARK_DAY, BENCHMARK_MONTH,
+                                                    BENCHMARK_YEAR, columnar=True)
+    return {'columns': columns, 'rows': rows}
+
+
+def measure(build, dumps, flight_data, repeat):
+    """
+    Runs build + dumps repeat times and keeps the fastest run
+    :return: Tuple of (build CPU seconds, encode CPU seconds, encoded size in bytes)
+    """
+    best = None
+    for _ in range(repeat):
+        started = time.process_time()
+        payload = build(flight_data)
+        built = time.process_time()
+        body = dumps(payload)
+        encoded = time.process_time()
+        timing = (built - started, encoded - built, len(body))
+        if best is None or sum(timing[:2]) < sum(best[:2]):
+            best = timing
+    return best
+
+
+def main():
+    """
+    Generates a database whose flights all share one date, fetches them through
+    FlightData.get_flights_by_date and compares CPU time and bytes per 10k rows
+    of the row-object and columnar responses, with the stdlib and orjson encoders
+    """
+    parser = argparse.ArgumentParser(description="Benchmark API row serialization paths")
+    parser.add_argument("--rows", type=int, default=10000, help="Rows per response")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per path, best is kept")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "benchmark.sqlite3")
+        generate_database(path, flights=args.rows)
+        with sqlite3.connect(path) as connection:
+            connection.execute("UPDATE flights SET DAY = ?, MONTH = ?, YEAR = ?",
+                               (BENCHMARK_DAY, BENCHMARK_MONTH, BENCHMARK_YEAR))
+        flight_data = data.FlightData(f"sqlite:///{path}")
+
+        paths = [("rows + json", rows_payload, stdlib_dumps),
+                 ("columnar + json", columnar_payload, stdlib_dumps)]
+        if orjson is not None:
+            paths += [("rows + orjson", rows_payload, orjson_dumps),
+                      ("columnar + orjson", columnar_payload, orjson_dumps)]
+        else:
+            print("orjson is not installed, skipping the orjson paths")
+
+        scale = 10000 / args.rows
+        baseline = None
+        print(f"{'path':<20}{'fetch ms':>10}{'encode ms':>11}{'total ms':>10}"
+              f"{'bytes':>12}{'CPU saved':>11}{'bytes saved':>13}")
+        for name, build, dumps in paths:
+            fetch, encode, size = measure(build, dumps, flight_data, args.repeat)
+            total = (fetch + encode) * scale
+            size = int(size * scale)
+            if baseline is None:
+                baseline = (total, size)
+            print(f"{name:<20}{fetch * scale * 1000:>10.1f}{encode * scale * 1000:>11.1f}"
+                  f"{total * 1000:>10.1f}{size:>12,}"
+                  f"{1 - total / baseline[0]:>11.0%}{1 - size / baseline[1]:>13.0%}")
+        del flight_data
+
+
+if __name__ == "__main__":
+    main()
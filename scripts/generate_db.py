@@ -0,0 +1,213 @@
+import argparse
+import os
+import random
+import sqlite3
+
+AIRLINES = [
+    ("UA", "United Air Lines Inc."),
+    ("AA", "American Airlines Inc."),
+    ("US", "US Airways Inc."),
+    ("F9", "Frontier Airlines Inc."),
+    ("B6", "JetBlue Airways"),
+    ("OO", "Skywest Airlines Inc."),
+    ("AS", "Alaska Airlines Inc."),
+    ("NK", "Spirit Air Lines"),
+    ("WN", "Southwest Airlines Co."),
+    ("DL", "Delta Air Lines Inc."),
+    ("EV", "Atlantic Southeast Airlines"),
+    ("HA", "Hawaiian Airlines Inc."),
+    ("MQ", "American Eagle Airlines Inc."),
+    ("VX", "Virgin America"),
+]
+
+# IATA code, airport, city, state, latitude, longitude, relative traffic weight
+AIRPORTS = [
+    ("ATL", "Hartsfield-Jackson Atlanta International Airport", "Atlanta", "GA",
+     33.64044, -84.42694, 10),
+    ("ORD", "Chicago O'Hare International Airport", "Chicago", "IL", 41.9796, -87.90446, 8),
+    ("DFW", "Dallas/Fort Worth International Airport", "Dallas-Fort Worth", "TX",
+     32.89595, -97.0372, 7),
+    ("DEN", "Denver International Airport", "Denver", "CO", 39.85841, -104.667, 6),
+    ("LAX", "Los Angeles International Airport", "Los Angeles", "CA", 33.94254, -118.40807, 7),
+    ("SFO", "San Francisco International Airport", "San Francisco", "CA", 37.619, -122.37484, 5),
+    ("PHX", "Phoenix Sky Harbor International Airport", "Phoenix", "AZ", 33.43417, -112.00806, 5),
+    ("IAH", "George Bush Intercontinental Airport", "Houston", "TX", 29.98047, -95.33972, 5),
+    ("LAS", "McCarran International Airport", "Las Vegas", "NV", 36.08036, -115.15233, 5),
+    ("MSP", "Minneapolis-Saint Paul International Airport", "Minneapolis", "MN",
+     44.88055, -93.21692, 4),
+    ("MCO", "Orlando International Airport", "Orlando", "FL", 28.42889, -81.31603, 4),
+    ("SEA", "Seattle-Tacoma International Airport", "Seattle", "WA", 47.44898, -122.30931, 4),
+    ("DTW", "Detroit Metropolitan Airport", "Detroit", "MI", 42.21206, -83.34884, 4),
+    ("BOS", "Gen. Edward Lawrence Logan International Airport", "Boston", "MA",
+     42.36435, -71.00518, 4),
+    ("EWR", "Newark Liberty International Airport", "Newark", "NJ", 40.6925, -74.16866, 3),
+    ("CLT", "Charlotte Douglas International Airport", "Charlotte", "NC", 35.21401, -80.94313, 4),
+    ("LGA", "LaGuardia Airport", "New York", "NY", 40.77724, -73.87261, 3),
+    ("JFK", "John F. Kennedy International Airport", "New York", "NY", 40.63975, -73.77893, 3),
+    ("SLC", "Salt Lake City International Airport", "Salt Lake City", "UT",
+     40.78839, -111.97777, 3),
+    ("BWI", "Baltimore-Washington International Airport", "Baltimore", "MD",
+     39.1754, -76.6682, 3),
+    ("MDW", "Chicago Midway International Airport", "Chicago", "IL", 41.78598, -87.75242, 2),
+    ("MIA", "Miami International Airport", "Miami", "FL", 25.79325, -80.29056, 3),
+    ("DCA", "Ronald Reagan Washington National Airport", "Arlington", "VA",
+     38.85208, -77.03772, 2),
+    ("SAN", "San Diego International Airport", "San Diego", "CA", 32.73356, -117.18966, 2),
+    ("FLL", "Fort Lauderdale-Hollywood International Airport", "Ft. Lauderdale", "FL",
+     26.07258, -80.15275, 2),
+    ("TPA", "Tampa International Airport", "Tampa", "FL", 27.97547, -82.53325, 2),
+    ("PDX", "Portland International Airport", "Portland", "OR", 45.58872, -122.5975, 2),
+    ("HNL", "Honolulu International Airport", "Honolulu", "HI", 21.31869, -157.92241, 2),
+    ("ANC", "Ted Stevens Anchorage International Airport", "Anchorage", "AK",
+     61.17432, -149.99619, 1),
+    ("BOI", "Boise Airport", "Boise", "ID", 43.56444, -116.22278, 1),
+]
+
+CREATE_TABLES = """
+CREATE TABLE airlines (
+    ID INTEGER PRIMARY KEY,
+    IATA_CODE TEXT,
+    AIRLINE TEXT
+);
+CREATE TABLE airports (
+    IATA_CODE TEXT PRIMARY KEY,
+    AIRPORT TEXT,
+    CITY TEXT,
+    STATE TEXT,
+    COUNTRY TEXT,
+    LATITUDE REAL,
+    LONGITUDE REAL
+);
+CREATE TABLE flights (
+    ID INTEGER PRIMARY KEY,
+    YEAR INTEGER,
+    MONTH INTEGER,
+    DAY INTEGER,
+    DAY_OF_WEEK INTEGER,
+    AIRLINE INTEGER,
+    FLIGHT_NUMBER INTEGER,
+    TAIL_NUMBER TEXT,
+    ORIGIN_AIRPORT TEXT,
+    DESTINATION_AIRPORT TEXT,
+    SCHEDULED_DEPARTURE TEXT,
+    DEPARTURE_TIME TEXT,
+    DEPARTURE_DELAY REAL,
+    DISTANCE INTEGER,
+    SCHEDULED_ARRIVAL TEXT,
+    ARRIVAL_TIME TEXT,
+    ARRIVAL_DELAY REAL,
+    DIVERTED INTEGER,
+    CANCELLED INTEGER
+);
+"""
+
+# Column order of the flights table and of the tuples yielded by generate_flights
+FLIGHT_COLUMNS = ("ID", "YEAR", "MONTH", "DAY", "DAY_OF_WEEK", "AIRLINE", "FLIGHT_NUMBER",
+                  "TAIL_NUMBER", "ORIGIN_AIRPORT", "DESTINATION_AIRPORT", "SCHEDULED_DEPARTURE",
+                  "DEPARTURE_TIME", "DEPARTURE_DELAY", "DISTANCE", "SCHEDULED_ARRIVAL",
+                  "ARRIVAL_TIME", "ARRIVAL_DELAY", "DIVERTED", "CANCELLED")
+
+INSERT_FLIGHT = f"INSERT INTO flights VALUES ({', '.join('?' * len(FLIGHT_COLUMNS))})"
+
+
+def generate_flights(count, years, seed):
+    """
+    Generates synthetic flights with a realistic shape: traffic concentrated on hub
+    airports, delays skewed towards the evening, about 2% cancelled flights.
+    :return: Generator of flights table tuples, IDs starting at 1
+    """
+    rng = random.Random(seed)
+    codes = [airport[0] for airport in AIRPORTS]
+    weights = [airport[6] for airport in AIRPORTS]
+    for flight_id in range(1, count + 1):
+        origin, destination = rng.choices(codes, weights, k=2)
+        while destination == origin:
+            destination = rng.choices(codes, weights)[0]
+        year = rng.choice(years)
+        month = rng.randint(1, 12)
+        day = rng.randint(1, 28)
+        hour = min(23, max(5, int(rng.gauss(13, 4))))
+        minute = rng.randrange(0, 60, 5)
+        scheduled = f"{hour:02d}{minute:02d}"
+
+        cancelled = rng.random() < 0.02
+        if cancelled:
+            departure_time = departure_delay = arrival_time = arrival_delay = None
+        else:
+            departure_delay = float(int(rng.expovariate(1 / (6 + hour))) - 5)
+            departure_minutes = (hour * 60 + minute + int(departure_delay)) % (24 * 60)
+            departure_time = f"{departure_minutes // 60:02d}{departure_minutes % 60:02d}"
+            arrival_delay = departure_delay + rng.randint(-15, 15)
+            arrival_time = f"{(departure_minutes // 60 + 2) % 24:02d}{departure_minutes % 60:02d}"
+        yield (flight_id, year, month, day, (day % 7) + 1,
+               rng.randint(1, len(AIRLINES)), rng.randint(1, 6000),
+               f"N{rng.randint(100, 999)}{rng.choice('ABCDEFUW')}{rng.choice('ABCDEFUW')}",
+               origin, destination, scheduled, departure_time, departure_delay,
+               rng.randint(150, 2800), f"{(hour + 2) % 24:02d}{minute:02d}",
+               arrival_time, arrival_delay, 0, int(cancelled))
+
+
+def create_database(path):
+    """
+    Creates an empty flights database with the airlines and airports tables filled
+    :return: Open sqlite3 connection
+    """
+    for stale in (path, f"{path}-wal", f"{path}-shm"):
+        if os.path.exists(stale):
+            os.remove(stale)
+    connection = sqlite3.connect(path)
+    connection.executescript(CREATE_TABLES)
+    connection.executemany("INSERT INTO airlines VALUES (?, ?, ?)",
+                           [(index + 1, code, name)
+                            for index, (code, name) in enumerate(AIRLINES)])
+    connection.executemany("INSERT INTO airports VALUES (?, ?, ?, ?, 'USA', ?, ?)",
+                           [airport[:6] for airport in AIRPORTS])
+    return connection
+
+
+def generate_database(path, flights=100000, years=(2015,), seed=42):
+    """
+    Writes a synthetic flights database with the same schema as flights.sqlite3
+    """
+    connection = create_database(path)
+    connection.executemany(INSERT_FLIGHT, generate_flights(flights, list(years), seed))
+    connection.commit()
+    connection.close()
+
+
+def generate_partitions(directory, flights=100000, years=(2015, 2016), seed=42):
+    """
+    Writes a synthetic database partitioned by year as flights_YYYY.sqlite3 files
+    """
+    os.makedirs(directory, exist_ok=True)
+    connections = {year: create_database(os.path.join(directory, f"flights_{year}.sqlite3"))
+                   for year in years}
+    for flight in generate_flights(flights, list(years), seed):
+        connections[flight[1]].execute(INSERT_FLIGHT, flight)
+    for connection in connections.values():
+        connection.commit()
+        connection.close()
+
+
+def main():
+    """
+    Command line entry point, see --help
+    """
+    parser = argparse.ArgumentParser(description="Generate a synthetic flights database")
+    parser.add_argument("path", help="Database file, or directory with --partitioned")
+    parser.add_argument("--flights", type=int, default=100000, help="Number of flights")
+    parser.add_argument("--years", type=int, nargs="+", default=[2015], help="Flight years")
+    parser.add_argument("--seed", type=int, default=42, help="Random seed")
+    parser.add_argument("--partitioned", action="store_true",
+                        help="Write one flights_YYYY.sqlite3 file per year into path")
+    args = parser.parse_args()
+
+    if args.partitioned:
+        generate_partitions(args.path, args.flights, args.years, args.seed)
+    else:
+        generate_database(args.path, args.flights, args.years, args.seed)
+    print(f"Generated {args.flights} flights in {args.path}")
+
+
+if __name__ == "__main__":
+    main()
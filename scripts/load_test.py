@@ -0,0 +1,482 @@
+import argparse
+import http.client
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from urllib.parse import urlencode, urlsplit
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from scripts.generate_db import AIRLINES, AIRPORTS, FLIGHT_COLUMNS, generate_flights, \
+    generate_partitions
+
+SWAGGER_FILE = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'backend',
+                                            'static', 'swagger.json'))
+SERVER_SCRIPT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'backend',
+                                             'server.py'))
+
+# Relative share of the traffic per documented endpoint, roughly what the map front end sends
+ENDPOINT_WEIGHTS = {
+    ('get', '/api/flight/{flight_id}'): 20,
+    ('get', '/api/flight/date'): 15,
+    ('get', '/api/search'): 20,
+    ('get', '/api/airports/near'): 10,
+    ('get', '/api/flight/routes'): 12,
+    ('get', '/api/flight/delay/'): 10,
+    ('get', '/api/flight/delay/percentage/'): 10,
+    ('get', '/api/routes/connections'): 8,
+    ('post', '/api/flights'): 3,
+}
+# Share of requests to endpoints supporting it that ask for format=columnar
+COLUMNAR_SHARE = 0.2
+SERVER_START_TIMEOUT = 120
+
+
+class TrafficMix:
+    """
+    The TrafficMix class draws requests for the endpoints documented in swagger.json,
+    weighted by ENDPOINT_WEIGHTS, with parameters shaped like the generated data:
+    airports picked by their traffic weight, flight IDs and dates within the
+    generated range, search prefixes of real names with occasional typos.
+    """
+
+    def __init__(self, flights, years, read_only=False):
+        """
+        Initialize the mix from the endpoints documented in swagger.json
+        :param flights: Number of flights in the database, bounds the flight IDs
+        :param years: Years of the flights in the database
+        :param read_only: Leave out the endpoints that write
+        """
+        self.flights = flights
+        self.years = list(years)
+        self.codes = [airport[0] for airport in AIRPORTS]
+        self.airport_weights = [airport[6] for airport in AIRPORTS]
+        self.locations = {airport[0]: (airport[4], airport[5]) for airport in AIRPORTS}
+        self.search_terms = ([airport[0] for airport in AIRPORTS]
+                             + [airport[2] for airport in AIRPORTS]
+                             + [airline[1] for airline in AIRLINES])
+
+        with open(SWAGGER_FILE) as swagger_file:
+            documented = json.load(swagger_file)['paths']
+        generators = {
+            '/api/flight/{flight_id}': self._flight_by_id,
+            '/api/flight/date': self._flights_by_date,
+            '/api/search': self._search,
+            '/api/airports/near': self._airports_near,
+            '/api/flight/routes': self._flight_routes,
+            '/api/flight/delay/': self._delayed_flights,
+            '/api/flight/delay/percentage/': self._delay_percentage,
+            '/api/flights': self._append_flights,
+            '/api/routes/connections': self._connections,
+        }
+        self.endpoints = []
+        for path, operations in documented.items():
+            for method, operation in operations.items():
+                weight = ENDPOINT_WEIGHTS.get((method, path))
+                if weight is None or path not in generators:
+                    print(f"Warning: {method.upper()} {path} is documented but not in the mix")
+                    continue
+                if read_only and method != 'get':
+                    continue
+                columnar = any(parameter['name'] == 'format'
+                               for parameter in operation.get('parameters', []))
+                self.endpoints.append((f"{method.upper()} {path}", method.upper(),
+                                       generators[path], columnar, weight))
+        self.weights = [endpoint[4] for endpoint in self.endpoints]
+
+    def draw(self, rng):
+        """
+        Draws the next request
+        :return: Tuple of (endpoint name, HTTP method, URL path with query string, JSON body)
+        """
+        name, method, generate, columnar, _ = rng.choices(self.endpoints, self.weights)[0]
+        path, params, body = generate(rng)
+        if columnar and rng.random() < COLUMNAR_SHARE:
+            params['format'] = 'columnar'
+        url = f"{path}?{urlencode(params)}" if params else path
+        return name, method, url, body
+
+    def _airport(self, rng):
+        return rng.choices(self.codes, self.airport_weights)[0]
+
+    def _offset(self, rng):
+        return rng.choice((0, 0, 0, 0, 10, 20))
+
+    def _flight_by_id(self, rng):
+        return f"/api/flight/{rng.randint(1, self.flights)}", {}, None
+
+    def _flights_by_date(self, rng):
+        return "/api/flight/date", {'day': rng.randint(1, 28), 'month': rng.randint(1, 12),
+                                    'year': rng.choice(self.years),
+                                    'offset': self._offset(rng)}, None
+
+    def _search(self, rng):
+        term = rng.choice(self.search_terms)
+        query = term[:rng.randint(2, max(2, len(term)))]
+        if len(query) > 3 and rng.random() < 0.1:
+            position = rng.randrange(len(query) - 1)
+            query = (query[:position] + query[position + 1] + query[position]
+                     + query[position + 2:])
+        params = {'q': query}
+        kind = rng.choice((None, None, 'airline', 'airport'))
+        if kind:
+            params['type'] = kind
+        return "/api/search", params, None
+
+    def _airports_near(self, rng):
+        lat, lon = self.locations[self._airport(rng)]
+        return "/api/airports/near", {'lat': round(lat + rng.uniform(-1, 1), 4),
+                                      'lon': round(lon + rng.uniform(-1, 1), 4),
+                                      'radius': rng.choice((50, 100, 250, 500))}, None
+
+    def _flight_routes(self, rng):
+        if rng.random() < 0.4:
+            return "/api/flight/routes", {'offset': self._offset(rng)}, None
+        lat, lon = self.locations[self._airport(rng)]
+        zoom = rng.randint(3, 9)
+        half_span = 180 / 2 ** zoom
+        bbox = (max(-180.0, lon - 2 * half_span), max(-90.0, lat - half_span),
+                min(180.0, lon + 2 * half_span), min(90.0, lat + half_span))
+        return "/api/flight/routes", {'bbox': ",".join(f"{value:.4f}" for value in bbox),
+                                      'zoom': zoom}, None
+
+    def _delayed_flights(self, rng):
+        if rng.random() < 0.5:
+            params = {'airline': rng.choice(AIRLINES)[1]}
+        else:
+            params = {'airport': self._airport(rng)}
+        params['offset'] = self._offset(rng)
+        return "/api/flight/delay/", params, None
+
+    def _delay_percentage(self, rng):
+        return "/api/flight/delay/percentage/", {
+            'category': rng.choice(('airline', 'hour', 'airports'))}, None
+
+    def _connections(self, rng):
+        origin = self._airport(rng)
+        destination = self._airport(rng)
+        while destination == origin:
+            destination = self._airport(rng)
+        return "/api/routes/connections", {
+            'origin': origin, 'destination': destination,
+            'max_stops': rng.choice((1, 2, 2)),
+            'weight': rng.choice(('delay', 'frequency'))}, None
+
+    def _append_flights(self, rng):
+        batch = generate_flights(rng.randint(1, 20), self.years, rng.random())
+        flights = [dict(zip(FLIGHT_COLUMNS[1:], flight[1:])) for flight in batch]
+        return "/api/flights", {}, json.dumps(flights)
+
+
+def percentile(ordered, fraction):
+    """
+    Nearest-rank percentile of an already sorted list
+    """
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def server_rss(pid):
+    """
+    Reads the resident memory of a server process and all its descendants from /proc
+    :return: Dictionary of pid to VmRSS in kilobytes, empty if the process is gone
+    """
+    parents = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as stat_file:
+                # The command name may contain spaces, the parent pid follows its ')'
+                parents[int(entry)] = int(stat_file.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+    tree, pending = [], [pid]
+    while pending:
+        current = pending.pop()
+        tree.append(current)
+        pending.extend(child for child, parent in parents.items() if parent == current)
+
+    rss = {}
+    for member in tree:
+        try:
+            with open(f'/proc/{member}/status') as status_file:
+                for line in status_file:
+                    if line.startswith('VmRSS:'):
+                        rss[member] = int(line.split()[1])
+                        break
+        except OSError:
+            continue
+    return rss
+
+
+def free_port():
+    """
+    Asks the OS for a free local TCP port
+    """
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        return probe.getsockname()[1]
+
+
+def start_server(partition_dir, port, workers, threads, log_path):
+    """
+    Starts backend/server.py on the partitions in partition_dir and waits until it answers
+    :return: The server subprocess
+    """
+    log_file = open(log_path, 'w')
+    process = subprocess.Popen(
+        [sys.executable, SERVER_SCRIPT, '--bind', f'127.0.0.1:{port}',
+         '--workers', str(workers), '--threads', str(threads)],
+        env=dict(os.environ, FLIGHTS_PARTITION_DIR=partition_dir),
+        stdout=log_file, stderr=subprocess.STDOUT)
+    log_file.close()
+    deadline = time.monotonic() + SERVER_START_TIMEOUT
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            break
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+            connection.request('GET', '/api/search?q=a')
+            connection.getresponse().read()
+            connection.close()
+            return process
+        except OSError:
+            time.sleep(0.25)
+    stop_server(process)
+    with open(log_path) as log_file:
+        print(log_file.read()[-4000:])
+    raise RuntimeError("The server did not start, see its log above")
+
+
+def stop_server(process):
+    """
+    Stops the server gracefully, killing it if it does not exit in time
+    """
+    if process.poll() is None:
+        process.terminate()
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+
+def run_client(host, port, mix, seed, stop_at, timeout, samples):
+    """
+    Sends requests back to back on one keep-alive connection until stop_at
+    :param samples: List receiving (finish time, endpoint name, status, latency seconds);
+        status 0 means the request failed without a response
+    """
+    rng = random.Random(seed)
+    connection = http.client.HTTPConnection(host, port, timeout=timeout)
+    headers = {'Content-Type': 'application/json'}
+    while time.monotonic() < stop_at:
+        name, method, url, body = mix.draw(rng)
+        started = time.monotonic()
+        try:
+            connection.request(method, url, body=body, headers=headers)
+            response = connection.getresponse()
+            response.read()
+            status = response.status
+            if response.will_close:
+                connection.close()
+        except (OSError, http.client.HTTPException):
+            status = 0
+            connection.close()
+        finished = time.monotonic()
+        samples.append((finished, name, status, finished - started))
+    connection.close()
+
+
+def sample_memory(pid, stop, interval, memory):
+    """
+    Records the server's total and largest process RSS every interval seconds
+    :param memory: List receiving (time, total RSS kB, largest process RSS kB, processes)
+    """
+    while not stop.wait(interval):
+        rss = server_rss(pid)
+        if rss:
+            memory.append((time.monotonic(), sum(rss.values()), max(rss.values()), len(rss)))
+
+
+def summarize(samples):
+    """
+    Computes request counts, status classes and latency percentiles of a set of samples
+    """
+    latencies = sorted(sample[3] for sample in samples)
+    statuses = [sample[2] for sample in samples]
+    failed = sum(1 for status in statuses if status == 0 or status >= 500)
+    return {
+        'requests': len(samples),
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p95_ms': percentile(latencies, 0.95) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'client_errors': sum(1 for status in statuses if 400 <= status < 500),
+        'shed_503': statuses.count(503),
+        'timeout_504': statuses.count(504),
+        'no_response': statuses.count(0),
+        'error_rate': failed / len(samples) if samples else 0.0,
+    }
+
+
+def print_report(samples, memory, started, duration, interval):
+    """
+    Prints throughput, latency percentiles and error rates per endpoint, then a
+    timeline of throughput, latency, errors and server RSS
+    """
+    by_endpoint = defaultdict(list)
+    for sample in samples:
+        by_endpoint[sample[1]].append(sample)
+
+    print(f"\n{'endpoint':<36}{'requests':>9}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}"
+          f"{'p99 ms':>9}{'4xx':>6}{'503':>6}{'504':>6}{'failed':>7}{'errors':>8}")
+    rows = sorted(by_endpoint.items()) + [('total', samples)]
+    report = {}
+    for name, endpoint_samples in rows:
+        summary = summarize(endpoint_samples)
+        summary['requests_per_second'] = summary['requests'] / duration
+        report[name] = summary
+        print(f"{name:<36}{summary['requests']:>9}{summary['requests_per_second']:>9.1f}"
+              f"{summary['p50_ms']:>9.1f}{summary['p95_ms']:>9.1f}{summary['p99_ms']:>9.1f}"
+              f"{summary['client_errors']:>6}{summary['shed_503']:>6}"
+              f"{summary['timeout_504']:>6}{summary['no_response']:>7}"
+              f"{summary['error_rate']:>8.1%}")
+
+    print(f"\n{'time s':>7}{'req/s':>9}{'p95 ms':>9}{'errors':>8}{'RSS MB':>9}"
+          f"{'max proc MB':>13}{'procs':>7}")
+    timeline = []
+    for bucket_start in range(0, max(1, int(duration)), interval):
+        low, high = started + bucket_start, started + min(duration, bucket_start + interval)
+        bucket = [sample for sample in samples if low <= sample[0] < high]
+        bucket_memory = [entry for entry in memory if low <= entry[0] < high]
+        summary = summarize(bucket)
+        point = {'time_s': bucket_start,
+                 'requests_per_second': len(bucket) / max(high - low, 1e-9),
+                 'p95_ms': summary['p95_ms'], 'error_rate': summary['error_rate']}
+        if bucket_memory:
+            point['rss_mb'] = bucket_memory[-1][1] / 1024
+            point['max_process_rss_mb'] = bucket_memory[-1][2] / 1024
+            point['processes'] = bucket_memory[-1][3]
+        timeline.append(point)
+        if bucket_memory:
+            memory_columns = (f"{point['rss_mb']:>9.1f}{point['max_process_rss_mb']:>13.1f}"
+                              f"{point['processes']:>7}")
+        else:
+            memory_columns = f"{'-':>9}{'-':>13}{'-':>7}"
+        print(f"{bucket_start:>7}{point['requests_per_second']:>9.1f}{point['p95_ms']:>9.1f}"
+              f"{point['error_rate']:>8.1%}{memory_columns}")
+    return {'endpoints': report, 'timeline': timeline}
+
+
+def run_load(host, port, mix, args, server_pid):
+    """
+    Runs the warm-up and the measured load phase with args.concurrency clients
+    :return: Report dictionary, see print_report
+    """
+    if args.warmup > 0:
+        print(f"Warming up for {args.warmup} s")
+        warmup_stop = time.monotonic() + args.warmup
+        clients = [threading.Thread(target=run_client,
+                                    args=(host, port, mix, args.seed + index, warmup_stop,
+                                          args.timeout, []))
+                   for index in range(args.concurrency)]
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join()
+
+    print(f"Running {args.concurrency} concurrent clients for {args.duration} s")
+    per_client = [[] for _ in range(args.concurrency)]
+    memory = []
+    stop_sampling = threading.Event()
+    started = time.monotonic()
+    stop_at = started + args.duration
+    sampler = None
+    if server_pid is not None:
+        sampler = threading.Thread(target=sample_memory,
+                                   args=(server_pid, stop_sampling, args.rss_interval, memory),
+                                   daemon=True)
+        sampler.start()
+    clients = [threading.Thread(target=run_client,
+                                args=(host, port, mix, args.seed + 1000 + index, stop_at,
+                                      args.timeout, per_client[index]))
+               for index in range(args.concurrency)]
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.join()
+    duration = time.monotonic() - started
+    stop_sampling.set()
+    if sampler is not None:
+        sampler.join()
+
+    samples = sorted(sample for client_samples in per_client for sample in client_samples)
+    return print_report(samples, memory, started, duration, args.report_interval)
+
+
+def main():
+    """
+    Generates a partitioned database, starts backend/server.py on it (or targets
+    --url) and replays a weighted mix of the documented endpoints with concurrent
+    clients, then reports throughput, latency percentiles, error rates and server
+    RSS over time. Runs fully offline.
+    """
+    parser = argparse.ArgumentParser(description="Load test the Flight Data API")
+    parser.add_argument("--url", help="Test an already running server instead of starting one; "
+                                      "--flights and --years must match its data")
+    parser.add_argument("--server-pid", type=int,
+                        help="Pid of the server given by --url, to sample its RSS")
+    parser.add_argument("--concurrency", type=int, default=16, help="Concurrent clients")
+    parser.add_argument("--duration", type=int, default=30, help="Measured seconds")
+    parser.add_argument("--warmup", type=int, default=3, help="Unmeasured seconds before")
+    parser.add_argument("--timeout", type=float, default=30, help="Request timeout in seconds")
+    parser.add_argument("--flights", type=int, default=100000, help="Flights to generate")
+    parser.add_argument("--years", type=int, nargs="+", default=[2015, 2016],
+                        help="Flight years, one partition each")
+    parser.add_argument("--workers", type=int, default=2, help="Server worker processes")
+    parser.add_argument("--threads", type=int, default=4, help="Threads per server worker")
+    parser.add_argument("--read-only", action="store_true", help="Do not POST new flights")
+    parser.add_argument("--seed", type=int, default=42, help="Random seed")
+    parser.add_argument("--report-interval", type=int, default=5,
+                        help="Seconds per timeline row")
+    parser.add_argument("--rss-interval", type=float, default=1.0,
+                        help="Seconds between server RSS samples")
+    parser.add_argument("--output", help="Also write the report as JSON to this file")
+    args = parser.parse_args()
+
+    mix = TrafficMix(args.flights, args.years, args.read_only)
+    if args.url:
+        address = urlsplit(args.url)
+        report = run_load(address.hostname, address.port or 80, mix, args, args.server_pid)
+    else:
+        with tempfile.TemporaryDirectory() as directory:
+            partition_dir = os.path.join(directory, 'partitions')
+            print(f"Generating {args.flights} flights in {partition_dir}")
+            generate_partitions(partition_dir, args.flights, args.years, args.seed)
+            port = free_port()
+            log_path = os.path.join(directory, 'server.log')
+            print(f"Starting the server on port {port} with {args.workers} workers "
+                  f"x {args.threads} threads")
+            server = start_server(partition_dir, port, args.workers, args.threads, log_path)
+            try:
+                report = run_load('127.0.0.1', port, mix, args, server.pid)
+            finally:
+                stop_server(server)
+
+    if args.output:
+        report['settings'] = vars(args)
+        with open(args.output, 'w') as output_file:
+            json.dump(report, output_file, indent=2)
+        print(f"\nReport written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()